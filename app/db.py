@@ -1,10 +1,105 @@
 import os
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import time
+from collections import deque
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 
 
-engine = create_async_engine(os.getenv("DATABASE_URL", ""))
+class DBStats:
+    """Pool checkout latency and query timing of an engine, read by the
+    internal stats endpoint to size the pool against the worker count."""
+
+    def __init__(self, slow_query_ms: float, keep_slow: int = 20) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.engine: Optional[AsyncEngine] = None
+        self.checkouts = 0
+        self.checkout_ms_total = 0.0
+        self.checkout_ms_max = 0.0
+        self.queries = 0
+        self.query_ms_total = 0.0
+        self.slow_queries = 0
+        self.recent_slow = deque(maxlen=keep_slow)
+
+    def attach(self, engine: AsyncEngine) -> None:
+        self.engine = engine
+        event.listen(engine.sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+        self.queries += 1
+        self.query_ms_total += elapsed_ms
+        if elapsed_ms >= self.slow_query_ms:
+            self.slow_queries += 1
+            self.recent_slow.append({"ms": round(elapsed_ms, 1), "statement": " ".join(statement.split())[:300]})
+            print(f"Slow query ({elapsed_ms:.0f} ms): {' '.join(statement.split())[:300]}")
+
+    def record_checkout(self, elapsed_ms: float) -> None:
+        self.checkouts += 1
+        self.checkout_ms_total += elapsed_ms
+        self.checkout_ms_max = max(self.checkout_ms_max, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        return {
+            "pool": {
+                "class": type(pool).__name__ if pool is not None else None,
+                "size": pool.size() if hasattr(pool, "size") else None,  # type: ignore
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,  # type: ignore
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else None,  # type: ignore
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,  # type: ignore
+            },
+            "checkouts": self.checkouts,
+            "checkout_ms_avg": round(self.checkout_ms_total / self.checkouts, 2) if self.checkouts else None,
+            "checkout_ms_max": round(self.checkout_ms_max, 2),
+            "queries": self.queries,
+            "query_ms_avg": round(self.query_ms_total / self.queries, 2) if self.queries else None,
+            "slow_query_ms": self.slow_query_ms,
+            "slow_queries": self.slow_queries,
+            "recent_slow": list(self.recent_slow),
+        }
+
+
+def create_engine_from_env(url: Optional[str] = None) -> AsyncEngine:
+    """Builds the async engine from the ``DB_*`` settings.
+
+    ``DB_POOL_SIZE``/``DB_MAX_OVERFLOW`` bound the connections per worker
+    process, ``DB_POOL_PRE_PING`` and ``DB_POOL_RECYCLE_SECONDS`` guard
+    against connections dropped by the server or a proxy, and
+    ``DB_STATEMENT_CACHE_SIZE`` sets the asyncpg prepared statement cache
+    (0 behind PgBouncer in transaction mode).
+    """
+    url = url or os.getenv("DATABASE_URL", "")
+    kwargs = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800)),
+    }
+    if not url.startswith("sqlite"):
+        kwargs.update(pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+                      max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+                      pool_timeout=float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30)))
+    if "asyncpg" in url:
+        kwargs["connect_args"] = {"statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))}
+    return create_async_engine(url, **kwargs)
+
+
+engine = create_engine_from_env()
+db_stats = DBStats(slow_query_ms=float(os.getenv("DB_SLOW_QUERY_MS", 200)))
+db_stats.attach(engine)
 SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
 
+async def get_db():
+    """The session dependency shared by every router. The connection is
+    checked out up front so the pool wait is measured."""
+    async with SessionLocal() as sl:
+        start = time.perf_counter()
+        await sl.connection()
+        db_stats.record_checkout((time.perf_counter() - start) * 1000)
+        yield sl
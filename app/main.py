@@ -1,16 +1,30 @@
 import os
+from contextlib import asynccontextmanager
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.services import Services
 from app.routers.phones import router as phone_router
 from app.routers.generate import router as gen_router
 from app.routers.users import user_router
+from app.routers.internal import router as internal_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    services = getattr(app.state, "services", None) or Services()
+    app.state.services = services
+    await services.startup()
+    yield
+    await services.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(phone_router, prefix="/phones")
 app.include_router(gen_router, prefix="/generate")
 app.include_router(user_router, prefix="/user")
+app.include_router(internal_router, prefix="/internal", include_in_schema=False)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://www.casecraft.space", "http://localhost:3000"],
@@ -1,4 +1,5 @@
 from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Numeric, UUID, Boolean, text
+from sqlalchemy import Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy import Enum
@@ -22,17 +23,33 @@ class PhoneModel(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     name = Column(String, nullable=False)
-    brand_id = Column(UUID(as_uuid=True), ForeignKey("phone_brands.id"), nullable=False, index=True)
+    brand_id = Column(UUID(as_uuid=True), ForeignKey("phone_brands.id"), nullable=False)
 
     phone_width = Column(Numeric(5, 2))  
     phone_height = Column(Numeric(5, 2)) 
 
     mask_available = Column(Boolean, server_default=text("false"), nullable=False)
+
+    # Render profile, precomputed by scripts/render_profiles.py
+    pixel_width = Column(Integer, nullable=True)
+    pixel_height = Column(Integer, nullable=True)
+    aspect_ratio = Column(String(8), nullable=True)
+    mask_key = Column(String, nullable=True)
+    mask_etag = Column(String, nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
 
     brand = relationship("PhoneBrand", back_populates="models")
 
+    __table_args__ = (
+        UniqueConstraint("brand_id", "name", name="uq_phone_models_brand_id_name"),
+        # Only models with a mask are ever listed, so only those are indexed;
+        # name is included so a brand's models come back already ordered
+        Index("ix_phone_models_brand_id_mask_available", "brand_id", "name",
+              postgresql_where=text("mask_available"), sqlite_where=text("mask_available = 1")),
+    )
+
 
 class AuthProvider(enum.Enum):
     local = "local"
@@ -0,0 +1,25 @@
+import os
+from redis.asyncio import BlockingConnectionPool, ConnectionPool
+
+
+def create_redis_pool() -> ConnectionPool:
+    """Builds the app-wide async Redis connection pool."""
+    return ConnectionPool(host=os.getenv("REDIS_SERVER", "localhost"),
+                          port=int(os.getenv("REDIS_PORT", 6379)),
+                          max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+                          decode_responses=True)
+
+
+def create_stream_redis_pool() -> BlockingConnectionPool:
+    """Builds the pool of the blocking XREADs of the event streams.
+
+    Each open stream holds a connection for up to a heartbeat, so they get
+    their own pool of ``REDIS_STREAM_MAX_CONNECTIONS`` and can never starve
+    the app-wide pool. Readers beyond the limit wait for a connection
+    instead of failing.
+    """
+    return BlockingConnectionPool(host=os.getenv("REDIS_SERVER", "localhost"),
+                                  port=int(os.getenv("REDIS_PORT", 6379)),
+                                  max_connections=int(os.getenv("REDIS_STREAM_MAX_CONNECTIONS", 50)),
+                                  timeout=None,
+                                  decode_responses=True)
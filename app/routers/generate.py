@@ -1,48 +1,70 @@
+import os
+import json
 from typing import Annotated
-from fastapi import APIRouter, Depends, BackgroundTasks, Request, HTTPException
-from fastapi.responses import JSONResponse
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.db import SessionLocal
+from fastapi import APIRouter, Depends, Query, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from redis.asyncio import Redis
+from app.services import Services, get_catalog, get_services, get_redis, get_stream_redis, get_utils, get_current_user_id
 from uuid import uuid4
 
 from app.schemas import PromptInput
-from app.models import PhoneModel
+from scripts.catalog import PhoneCatalog
+from scripts.render_profiles import RenderProfile
 from scripts.utils import Utils
-from scripts.auth import AuthUtils
+from scripts import generation_jobs
+from scripts.encoders import ANON_OUTPUT_FORMAT, USER_OUTPUT_FORMAT
+from scripts.upscale_queue import TERMINAL_STATUSES, UpscaleNotifier, job_key as upscale_job_key
 
 
 router = APIRouter()
-utils = Utils()
-auth_utils = AuthUtils()
 
 
-async def get_db():
-    async with SessionLocal() as sl:
-        yield sl
+redis_dependency = Annotated[Redis, Depends(get_redis)]
+stream_redis_dependency = Annotated[Redis, Depends(get_stream_redis)]
+utils_dependency = Annotated[Utils, Depends(get_utils)]
+services_dependency = Annotated[Services, Depends(get_services)]
+catalog_dependency = Annotated[PhoneCatalog, Depends(get_catalog)]
 
+DOWNLOAD_LINK_MAX_WAIT_SECONDS = float(os.getenv("DOWNLOAD_LINK_MAX_WAIT_SECONDS", 30))
 
-db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+async def get_render_profile(catalog: PhoneCatalog, r: Redis, phone_model_id: str) -> RenderProfile:
+    """Looks the phone model up in the in-memory catalog snapshot, so the
+    generate endpoints make no database round trip."""
+    profile = await catalog.get_profile(r, phone_model_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Could not find the selected phone model")
+    return profile
+
+
+async def submit_generation_job(payload: PromptInput, profile: RenderProfile, r: Redis, utils: Utils,
+                                services: Services, output_format: str) -> str:
+    job_id = await generation_jobs.create_job(r)
+    services.spawn(generation_jobs.run_generation_job(utils, r, job_id,
+                                                      prompt=payload.prompt,
+                                                      variants=payload.variants,
+                                                      upscaler=payload.upscaler,
+                                                      output_format=output_format,
+                                                      profile=profile))
+    return job_id
 
 
 @router.post("/anon/prompt-only")
 async def generate_with_just_prompt_anon(
-    payload: PromptInput , request: Request,bg_tasks: BackgroundTasks, db: db_dependency
+    payload: PromptInput , request: Request, r: redis_dependency,
+    utils: utils_dependency, catalog: catalog_dependency
     ):
     anon_id = request.cookies.get("anon_id")
     if not anon_id:
             anon_id = str(uuid4())
-    utils.validate_max_gen_anon(anon_id)
-    result = await db.execute(select(PhoneModel).where(PhoneModel.id == payload.phone_model_id))
-    phone_mdl_parm = result.scalar_one_or_none()
-    if not phone_mdl_parm:
-        raise HTTPException(status_code=404, detail="User with given email already exists")
+    profile = await get_render_profile(catalog, r, payload.phone_model_id)
+    await utils.check_generation_quota(r, "anon", anon_id)
     return_data = await utils.handle_generation(prompt=payload.prompt,
-                                                phone_height=phone_mdl_parm.phone_height, #type: ignore
-                                                phone_width=phone_mdl_parm.phone_width, #type: ignore
-                                                model_id=phone_mdl_parm.id, #type: ignore
-                                                brand_id=phone_mdl_parm.brand_id, #type: ignore
-                                                bg_tasks=bg_tasks)
+                                                profile=profile,
+                                                r=r,
+                                                variants=payload.variants,
+                                                upscaler=payload.upscaler,
+                                                output_format=ANON_OUTPUT_FORMAT)
     response = JSONResponse(content=return_data)
     response.set_cookie(key="anon_id", value=anon_id, max_age=60*60*24*30)
     return response
@@ -51,26 +73,105 @@ async def generate_with_just_prompt_anon(
 @router.post("/user/prompt-only")
 async def generate_with_just_prompt(
     payload: PromptInput, 
-    bg_tasks: BackgroundTasks, 
-    db: db_dependency, 
-    user_id: str = Depends(auth_utils.get_current_user_id)
+    r: redis_dependency,
+    utils: utils_dependency,
+    catalog: catalog_dependency,
+    user_id: str = Depends(get_current_user_id)
     ):
-    result = await db.execute(select(PhoneModel).where(PhoneModel.id == payload.phone_model_id))
-    phone_mdl_parm = result.scalar_one_or_none()
-    if not phone_mdl_parm:
-        raise HTTPException(status_code=404, detail="User with given email already exists")
+    profile = await get_render_profile(catalog, r, payload.phone_model_id)
+    await utils.check_generation_quota(r, "user", user_id)
     return_data = await utils.handle_generation(prompt=payload.prompt,
-                                                phone_height=phone_mdl_parm.phone_height, #type: ignore
-                                                phone_width=phone_mdl_parm.phone_width, #type: ignore
-                                                model_id=phone_mdl_parm.id, #type: ignore
-                                                brand_id=phone_mdl_parm.brand_id, #type: ignore
-                                                bg_tasks=bg_tasks)
+                                                profile=profile,
+                                                r=r,
+                                                variants=payload.variants,
+                                                upscaler=payload.upscaler,
+                                                output_format=USER_OUTPUT_FORMAT)
     return return_data
 
 
 @router.get("/get-download-link/{img_uuid}")
-async def get_download_link(img_uuid: str):
-    download_link = utils.get_image_download_link(img_uuid)
+async def get_download_link(img_uuid: str, r: redis_dependency, utils: utils_dependency,
+                            services: services_dependency,
+                            wait: float = Query(0, ge=0, description="Seconds to hold the request while pending")):
+    if wait:
+        # Long poll: answered as soon as the upscaler publishes the result,
+        # "pending" after the wait so the client simply asks again
+        await services.upscale_notifier.wait(img_uuid, min(wait, DOWNLOAD_LINK_MAX_WAIT_SECONDS))
+    download_link = await utils.get_image_download_link(img_uuid, r)
     if not download_link or download_link == "None":
         raise HTTPException(404, detail="Could not find the specified image. It may have been expired")
-    return download_link
\ No newline at end of file
+    if download_link == "failed":
+        raise HTTPException(500, detail="Could not upscale the image. Kindly generate it again")
+    return download_link
+
+
+async def download_link_events(notifier: UpscaleNotifier, img_uuid: str, heartbeat: float = 15.0):
+    while True:
+        job = await notifier.wait(img_uuid, heartbeat)
+        status = job.get("status")
+        if status == "done":
+            yield f"event: ready\ndata: {json.dumps({'url': job['url']})}\n\n"
+            return
+        if status in TERMINAL_STATUSES or not job:
+            yield f"event: failed\ndata: {json.dumps({'detail': 'Could not upscale the image. Kindly generate it again'})}\n\n"
+            return
+        yield ": keep-alive\n\n"
+
+
+@router.get("/get-download-link/{img_uuid}/events")
+async def get_download_link_events(img_uuid: str, r: redis_dependency, services: services_dependency):
+    if not await r.exists(upscale_job_key(img_uuid)):
+        raise HTTPException(404, detail="Could not find the specified image. It may have been expired")
+    return StreamingResponse(download_link_events(services.upscale_notifier, img_uuid),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/anon/prompt-only/jobs", status_code=202)
+async def submit_generation_anon(
+    payload: PromptInput, request: Request, r: redis_dependency,
+    utils: utils_dependency, services: services_dependency, catalog: catalog_dependency
+    ):
+    anon_id = request.cookies.get("anon_id")
+    if not anon_id:
+            anon_id = str(uuid4())
+    profile = await get_render_profile(catalog, r, payload.phone_model_id)
+    await utils.check_generation_quota(r, "anon", anon_id)
+    job_id = await submit_generation_job(payload, profile, r, utils, services, ANON_OUTPUT_FORMAT)
+    response = JSONResponse(status_code=202, content={"job_id": job_id})
+    response.set_cookie(key="anon_id", value=anon_id, max_age=60*60*24*30)
+    return response
+
+
+@router.post("/user/prompt-only/jobs", status_code=202)
+async def submit_generation(
+    payload: PromptInput,
+    r: redis_dependency,
+    utils: utils_dependency,
+    services: services_dependency,
+    catalog: catalog_dependency,
+    user_id: str = Depends(get_current_user_id)
+    ):
+    profile = await get_render_profile(catalog, r, payload.phone_model_id)
+    await utils.check_generation_quota(r, "user", user_id)
+    job_id = await submit_generation_job(payload, profile, r, utils, services, USER_OUTPUT_FORMAT)
+    return {"job_id": job_id}
+
+
+@router.get("/jobs/{job_id}")
+async def get_generation_job(job_id: str, r: redis_dependency):
+    job = await generation_jobs.get_job(r, job_id)
+    if not job:
+        raise HTTPException(404, detail="Could not find the specified job. It may have been expired")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def generation_job_events(job_id: str, request: Request, r: redis_dependency,
+                                stream_r: stream_redis_dependency):
+    if not await r.exists(generation_jobs.job_key(job_id)):
+        raise HTTPException(404, detail="Could not find the specified job. It may have been expired")
+    last_event_id = request.headers.get("last-event-id", "0")
+    return StreamingResponse(generation_jobs.stream_events(stream_r, job_id, last_event_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,24 @@
+import os
+import secrets
+from typing import Annotated, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from app.services import Services, get_services
+
+
+router = APIRouter()
+
+services_dependency = Annotated[Services, Depends(get_services)]
+
+
+def verify_internal_token(x_internal_token: Optional[str] = Header(default=None)):
+    """Internal endpoints only exist when ``INTERNAL_STATS_TOKEN`` is set and
+    the caller sends it in ``X-Internal-Token``."""
+    expected = os.getenv("INTERNAL_STATS_TOKEN")
+    if not expected or not x_internal_token or not secrets.compare_digest(x_internal_token, expected):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@router.get("/stats", dependencies=[Depends(verify_internal_token)])
+async def get_stats(services: services_dependency):
+    return await services.stats()
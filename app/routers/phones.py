@@ -1,30 +1,30 @@
-from fastapi import APIRouter, Depends
-from app.db import SessionLocal
-from app.models import PhoneBrand, PhoneModel
-from sqlalchemy.future import select
-from sqlalchemy import distinct
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Optional
+from fastapi import APIRouter, Depends, Header, Response
+from redis.asyncio import Redis
 
+from app.services import get_catalog, get_redis
+from scripts.catalog import CatalogEntry, PhoneCatalog
 
 
 router = APIRouter()
 
+catalog_dependency = Annotated[PhoneCatalog, Depends(get_catalog)]
+redis_dependency = Annotated[Redis, Depends(get_redis)]
 
-async def get_db():
-    async with SessionLocal() as sl:
-        yield sl
+
+def catalog_response(entry: CatalogEntry, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "public, max-age=60, stale-while-revalidate=300"}
+    if entry.matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 
 @router.get("/brands")
-async def get_phone_brands(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(PhoneBrand).join(PhoneModel, PhoneBrand.id == PhoneModel.brand_id).where(PhoneModel.mask_available == True).distinct()
-    )
-    brands = result.scalars().all()
-    return [{"id": brand.id, "name": brand.name} for brand in brands]
+async def get_phone_brands(catalog: catalog_dependency, r: redis_dependency,
+                           if_none_match: Optional[str] = Header(default=None)):
+    return catalog_response(await catalog.get_brands(r), if_none_match)
 
 @router.get("/brands/{brand_id}/models")
-async def get_phone_models(brand_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(PhoneModel).where((PhoneModel.brand_id == brand_id) & (PhoneModel.mask_available == True)))
-    models = result.scalars().all()
-    return [{"id": model.id, "name": model.name} for model in models]
\ No newline at end of file
+async def get_phone_models(brand_id: str, catalog: catalog_dependency, r: redis_dependency,
+                           if_none_match: Optional[str] = Header(default=None)):
+    return catalog_response(await catalog.get_models(r, brand_id), if_none_match)
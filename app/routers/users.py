@@ -5,11 +5,13 @@ from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import status
 from app.models import UserModel, AuthProvider
 from app.schemas import UserCreate, UserLogin, PasswordResetRequest, ResetPassword
-from app.db import SessionLocal
+from app.db import get_db
+from app.services import get_redis, get_utils, get_auth_utils
 from scripts.utils import Utils
 from scripts.auth import AuthUtils
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
 from pydantic import ValidationError
 from fastapi.responses import RedirectResponse
 from urllib.parse import urlencode
@@ -17,22 +19,19 @@ from urllib.parse import urlencode
 
 
 user_router = APIRouter()
-utils = Utils()
-auth_utils = AuthUtils()
-
-async def get_db():
-    async with SessionLocal() as sl:
-        yield sl
 
 db_dependency = Annotated[AsyncSession, Depends(get_db)]
+redis_dependency = Annotated[Redis, Depends(get_redis)]
+utils_dependency = Annotated[Utils, Depends(get_utils)]
+auth_utils_dependency = Annotated[AuthUtils, Depends(get_auth_utils)]
 
 @user_router.post("/user-signup")
-async def user_sign_up(user_data: UserCreate, db: db_dependency):
+async def user_sign_up(user_data: UserCreate, db: db_dependency, utils: utils_dependency):
     result = await db.execute(select(UserModel).where(UserModel.email == user_data.email))
     if result.scalar_one_or_none():
         raise HTTPException(status_code=409, detail="User with given email already exists")
     
-    hashed_pass = utils.hash_password(user_data.password)
+    hashed_pass = await utils.hash_password(user_data.password)
     new_user = UserModel(email=user_data.email, 
                          name=user_data.name, 
                          password=hashed_pass)
@@ -42,7 +41,8 @@ async def user_sign_up(user_data: UserCreate, db: db_dependency):
     return {"message": "User created successfully"}
 
 @user_router.post("/user-login")
-async def user_log_in(db: db_dependency, form_data: OAuth2PasswordRequestForm = Depends()):
+async def user_log_in(db: db_dependency, utils: utils_dependency, auth_utils: auth_utils_dependency,
+                      form_data: OAuth2PasswordRequestForm = Depends()):
     try:
         user_data = UserLogin(email=form_data.username, password=form_data.password)
     except ValidationError as ve:
@@ -50,21 +50,28 @@ async def user_log_in(db: db_dependency, form_data: OAuth2PasswordRequestForm =
                             detail=ve.errors()[0].get('ctx').get('reason')) #type: ignore
     result = await db.execute(select(UserModel).where(UserModel.email == user_data.email))
     user = result.scalar_one_or_none()
-    if not user or not  utils.verify_pass_word(user_data.password, user.password): #type: ignore
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid Credentials")
+    valid, new_hash = await utils.verify_pass_word(user_data.password, user.password) #type: ignore
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid Credentials")
+    if new_hash:
+        # bcrypt hash or outdated argon2 cost, upgraded now that the password is known
+        user.password = new_hash #type: ignore
+        await db.commit()
     token_data = {"public_id": str(user.public_id), "name": user.name, "email": user.email}
     jwt_token = auth_utils.create_access_token(data=token_data)
     return {"access_token": jwt_token, "token_type": "bearer"}
 
 
 @user_router.get("/google-login")
-async def google_login(request : Request):
+async def google_login(request : Request, auth_utils: auth_utils_dependency):
     redirect_uri = os.getenv("GOOGLE_REDIRECT_URI")
     return await auth_utils.google_oauth.google.authorize_redirect(request, redirect_uri) #type: ignore
 
 
 @user_router.get("/google/callback")
-async def google_callback(request: Request, db: db_dependency):
+async def google_callback(request: Request, db: db_dependency, auth_utils: auth_utils_dependency):
     token = await auth_utils.google_oauth.google.authorize_access_token(request) #type: ignore
     user_info = token.get("userinfo")
     if not user_info:
@@ -87,7 +94,8 @@ async def google_callback(request: Request, db: db_dependency):
 
 
 @user_router.post("/send-password-reset-mail")
-async def send_password_reset_mail(req_data: PasswordResetRequest, db:db_dependency):
+async def send_password_reset_mail(req_data: PasswordResetRequest, db:db_dependency, r: redis_dependency,
+                                  utils: utils_dependency, auth_utils: auth_utils_dependency):
     result = await db.execute(select(UserModel).where(UserModel.email == req_data.email))
     user_data = result.scalar_one_or_none()
     if not user_data:
@@ -96,21 +104,22 @@ async def send_password_reset_mail(req_data: PasswordResetRequest, db:db_depende
     if user_data.auth_provider != AuthProvider.local: #type: ignore
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
                             detail=f"This account is connected via {str(user_data.auth_provider).capitalize()}. Use that to sign in or reset password")
-    reset_link = auth_utils.get_reset_link(user_data.email)  #type: ignore
+    reset_link = await auth_utils.get_reset_link(user_data.email, r)  #type: ignore
     utils.send_reset_mail(to_email=user_data.email, reset_link=reset_link) #type: ignore
     return {"message": "Password reset link sent"}
 
 
 @user_router.post("/reset-password")
-async def reset_password(data: ResetPassword, db: db_dependency):
-    user_email = auth_utils.validate_reset_token(token=data.token)
+async def reset_password(data: ResetPassword, db: db_dependency, r: redis_dependency,
+                         utils: utils_dependency, auth_utils: auth_utils_dependency):
+    user_email = await auth_utils.validate_reset_token(token=data.token, r=r)
     result = await db.execute(select(UserModel).where(UserModel.email == user_email))
     user_data = result.scalar_one_or_none()
     if not user_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Could not find User")
-    user_data.password = utils.hash_password(data.new_password) #type: ignore
+    user_data.password = await utils.hash_password(data.new_password) #type: ignore
     await db.commit()
-    auth_utils.delete_reset_token(data.token)
+    await auth_utils.delete_reset_token(data.token, r)
     return {"message": "Your password has been successfully reset"}
     
\ No newline at end of file
@@ -1,4 +1,5 @@
 import re
+from typing import Literal, Optional
 from pydantic import BaseModel, EmailStr, Field, field_validator
 from fastapi import HTTPException
 
@@ -37,9 +38,15 @@ class UserCreate(BaseModel):
         return v
 
 
+MAX_VARIANTS = 4
+
+
 class PromptInput(BaseModel):
     prompt: str
     phone_model_id: str
+    variants: int = Field(default=1, ge=1, le=MAX_VARIANTS)
+    # Upscaler of the download version, UPSCALE_BACKEND decides when omitted
+    upscaler: Optional[Literal["auto", "replicate", "lanczos"]] = None
 
 class PasswordResetRequest(BaseModel):
     email: str
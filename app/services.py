@@ -0,0 +1,122 @@
+import os
+import asyncio
+from typing import Optional
+from fastapi import Depends, Request
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.db import SessionLocal, engine, db_stats
+from app.redis_client import create_redis_pool, create_stream_redis_pool
+from scripts.utils import Utils
+from scripts.auth import AuthUtils
+from scripts.catalog import PhoneCatalog
+from scripts.encoders import ANON_OUTPUT_FORMAT, USER_OUTPUT_FORMAT, check_output_formats
+from scripts.upscale_queue import UpscaleNotifier
+
+
+class Services:
+    """Clients shared by every router, built once per process in the app lifespan.
+
+    Any client can be passed in explicitly, which lets tests and local runs
+    swap in stand-ins (e.g. a fakeredis client or a Utils subclass) without
+    touching the routers. ``stream_redis`` serves the blocking reads of the
+    event streams and defaults to ``redis`` when that one is passed in.
+    """
+
+    def __init__(self, utils: Optional[Utils] = None, auth_utils: Optional[AuthUtils] = None,
+                 redis: Optional[Redis] = None, catalog: Optional[PhoneCatalog] = None,
+                 stream_redis: Optional[Redis] = None) -> None:
+        self.utils = utils or Utils()
+        self.auth_utils = auth_utils or AuthUtils()
+        self.stream_redis = stream_redis or redis or Redis(connection_pool=create_stream_redis_pool())
+        self.redis = redis or Redis(connection_pool=create_redis_pool())
+        self.catalog = catalog or PhoneCatalog(SessionLocal)
+        self.upscale_notifier = UpscaleNotifier(self.redis)
+        self.background_tasks = set()
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Runs a coroutine detached from the request that started it. Tasks
+        still running at shutdown are cancelled."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def startup(self) -> None:
+        if os.getenv("PRELOAD_HEAVY_MODULES", "false").lower() in ("1", "true", "yes"):
+            self.utils.warm_up()
+        try:
+            await asyncio.to_thread(check_output_formats, ANON_OUTPUT_FORMAT, USER_OUTPUT_FORMAT)
+            print(f"✅ Output formats {ANON_OUTPUT_FORMAT} (anon) and {USER_OUTPUT_FORMAT} (user) can be encoded.")
+        except ValueError as err:
+            print(f"❌ {err}")
+            raise
+        try:
+            await self.redis.ping()
+            print("✅ Redis server is running.")
+        except RedisConnectionError:
+            print("❌ Redis server is NOT running.")
+            raise
+
+    async def shutdown(self) -> None:
+        for task in list(self.background_tasks):
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        if "mailer" in self.utils.__dict__:
+            await self.utils.mailer.close()
+        await self.upscale_notifier.close()
+        if self.stream_redis is not self.redis:
+            await self.stream_redis.aclose(close_connection_pool=True)
+        await self.redis.aclose(close_connection_pool=True)
+        self.utils.close()
+        await engine.dispose()
+
+    async def stats(self) -> dict:
+        """Counters of the shared clients, for the internal stats endpoint.
+        Lazily created clients that were never used are left out."""
+        built = self.utils.__dict__
+        stats = {
+            "db": db_stats.snapshot(),
+            "catalog": self.catalog.stats(),
+            "jwt_claims_cache": self.auth_utils.claims_cache.stats(),
+            "upscale_notifier": self.upscale_notifier.stats(),
+            "background_tasks": len(self.background_tasks),
+        }
+        for name in ("mask_cache", "image_pipeline", "provider_router", "passwords", "mailer"):
+            if name in built:
+                stats[name] = built[name].stats()
+        if "prompt_cache" in built:
+            stats["prompt_cache"] = await built["prompt_cache"].stats(self.redis)
+        return stats
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+def get_utils(request: Request) -> Utils:
+    return request.app.state.services.utils
+
+
+def get_auth_utils(request: Request) -> AuthUtils:
+    return request.app.state.services.auth_utils
+
+
+def get_catalog(request: Request) -> PhoneCatalog:
+    return request.app.state.services.catalog
+
+
+def get_redis(request: Request) -> Redis:
+    """FastAPI dependency returning a client bound to the shared pool."""
+    return request.app.state.services.redis
+
+
+def get_stream_redis(request: Request) -> Redis:
+    """FastAPI dependency returning the client for blocking stream reads."""
+    return request.app.state.services.stream_redis
+
+
+async def get_current_user_id(token: str = Depends(AuthUtils.oauth2_scheme),
+                              auth_utils: AuthUtils = Depends(get_auth_utils)):
+    # async so the cached fast path runs on the loop instead of a threadpool hop
+    return auth_utils.get_current_user_id(token)
@@ -0,0 +1,35 @@
+"""partial index on masked phone models and unique model name per brand
+
+Revision ID: b7e3c1a9d2f4
+Revises: 06798a203cb0
+Create Date: 2026-10-18 10:12:31.204118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3c1a9d2f4'
+down_revision: Union[str, Sequence[str], None] = '06798a203cb0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_phone_models_brand_id_mask_available', 'phone_models', ['brand_id', 'name'], unique=False,
+                    postgresql_where=sa.text('mask_available'), sqlite_where=sa.text('mask_available = 1'))
+    op.create_unique_constraint('uq_phone_models_brand_id_name', 'phone_models', ['brand_id', 'name'])
+    # Lookups by brand_id are served by the leading column of the unique constraint
+    op.drop_index('ix_phone_models_brand_id', table_name='phone_models')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_phone_models_brand_id', 'phone_models', ['brand_id'], unique=False)
+    op.drop_constraint('uq_phone_models_brand_id_name', 'phone_models', type_='unique')
+    op.drop_index('ix_phone_models_brand_id_mask_available', table_name='phone_models',
+                  postgresql_where=sa.text('mask_available'))
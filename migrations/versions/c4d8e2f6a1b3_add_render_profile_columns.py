@@ -0,0 +1,38 @@
+"""add render profile columns to phone models
+
+Revision ID: c4d8e2f6a1b3
+Revises: b7e3c1a9d2f4
+Create Date: 2026-10-18 11:40:07.518362
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d8e2f6a1b3'
+down_revision: Union[str, Sequence[str], None] = 'b7e3c1a9d2f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('phone_models', sa.Column('pixel_width', sa.Integer(), nullable=True))
+    op.add_column('phone_models', sa.Column('pixel_height', sa.Integer(), nullable=True))
+    op.add_column('phone_models', sa.Column('aspect_ratio', sa.String(length=8), nullable=True))
+    op.add_column('phone_models', sa.Column('mask_key', sa.String(), nullable=True))
+    op.add_column('phone_models', sa.Column('mask_etag', sa.String(), nullable=True))
+    # Filled by `python -m scripts.render_profiles`; until then the API
+    # computes missing profiles when it loads the catalog
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('phone_models', 'mask_etag')
+    op.drop_column('phone_models', 'mask_key')
+    op.drop_column('phone_models', 'aspect_ratio')
+    op.drop_column('phone_models', 'pixel_height')
+    op.drop_column('phone_models', 'pixel_width')
@@ -1,14 +1,77 @@
 import os
-import sys
-import redis
-import redis.exceptions
+import time
+import hashlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from authlib.integrations.starlette_client import OAuth
 from starlette.config import Config
-from sympy import N
+from redis.asyncio import Redis
+
+
+def load_signing_keys() -> dict:
+    """Parses ``JWT_SIGNING_KEYS`` (``kid:secret`` pairs, comma separated).
+
+    Every listed key verifies tokens carrying its ``kid`` header; new tokens
+    are signed with ``JWT_ACTIVE_KID`` (the first key by default). To rotate,
+    add the new key, make it active, and drop the old one once the tokens
+    it signed have expired. ``SECRET_KEY`` keeps verifying tokens without a
+    ``kid`` and signs new ones when no keys are listed.
+    """
+    keys = {}
+    for pair in os.getenv("JWT_SIGNING_KEYS", "").split(","):
+        kid, _, secret = pair.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret
+    return keys
+
+
+class ClaimsCache:
+    """LRU of verified JWT claims keyed by the SHA-256 digest of the token.
+
+    An entry lives at most ``ttl`` seconds and never past the token's
+    ``exp``, so a cached token stops being accepted exactly when decoding
+    it would start failing. Only successfully verified tokens are stored.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None) -> None:
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("JWT_CLAIMS_CACHE_SIZE", 10000))
+        self.ttl = ttl if ttl is not None else float(os.getenv("JWT_CLAIMS_CACHE_TTL_SECONDS", 300))
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        entry = self._entries.get(digest)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, digest: bytes, claims: dict) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, claims["exp"])
+        self._entries[digest] = (claims, expires_at)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
 
 
 class AuthUtils:
@@ -18,6 +81,11 @@ class AuthUtils:
         self.secret_key = os.getenv("SECRET_KEY", "")
         self.jwt_algo = os.getenv("JWT_ALGORITHM", "")
         self.token_exp_time = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "0"))
+        self.signing_keys = load_signing_keys()
+        self.active_kid = os.getenv("JWT_ACTIVE_KID") or next(iter(self.signing_keys), None)
+        if self.active_kid is not None and self.active_kid not in self.signing_keys:
+            raise ValueError(f"JWT_ACTIVE_KID {self.active_kid} is not in JWT_SIGNING_KEYS")
+        self.claims_cache = ClaimsCache()
         config_data = {
             "GOOGLE_CLIENT_ID": os.getenv("GOOGLE_CLIENT_ID"),
             "GOOGLE_CLIENT_SECRET": os.getenv("GOOGLE_CLIENT_SECRET"),
@@ -39,16 +107,6 @@ class AuthUtils:
             client_kwargs={"scope": os.getenv("GOOGLE_API_SCOPE")},
             server_metadata_url=os.getenv("GOOGLE_SERVER_METADATA_URL")
         )
-        try:
-            self.r = redis.Redis(host=os.getenv("REDIS_SERVER", "localhost"), 
-                                 port=int(os.getenv("REDIS_PORT", 0)), 
-                                 decode_responses=True)
-            self.r.ping()
-            print("✅ Redis server is running.")
-        except redis.exceptions.ConnectionError:
-            print("❌ Redis server is NOT running.")
-            sys.exit(1)
-            
 
     def create_access_token(self, data: dict, exp_min: int = 0):
         """_summary_
@@ -64,50 +122,73 @@ class AuthUtils:
         exp_min = exp_min if exp_min else self.token_exp_time
         expire = (datetime.now() + timedelta(minutes=exp_min)).timestamp()
         to_encode.update({"exp": expire})
-        return jwt.encode(to_encode, self.secret_key, algorithm=self.jwt_algo)
-    
+        if self.active_kid is None:
+            return jwt.encode(to_encode, self.secret_key, algorithm=self.jwt_algo)
+        return jwt.encode(to_encode, self.signing_keys[self.active_kid], algorithm=self.jwt_algo,
+                          headers={"kid": self.active_kid})
+
+    def decode_token(self, token: str) -> dict:
+        """Verifies a token with the key named by its ``kid`` header, or with
+        ``SECRET_KEY`` when it has none.
+
+        Raises:
+            JWTError: Bad signature, expired token or unknown ``kid``
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            key = self.secret_key
+        elif kid in self.signing_keys:
+            key = self.signing_keys[kid]
+        else:
+            raise JWTError(f"Unknown signing key {kid}")
+        return jwt.decode(token, key, algorithms=[self.jwt_algo])
+
     def get_current_user_id(self, token: str = Depends(oauth2_scheme)):
-        """_summary_
+        """Returns the ``public_id`` claim of a bearer token. Verified claims
+        are served from the claims cache until the token expires, so polling
+        clients pay for signature verification once.
 
         Args:
             token (str, optional): _description_. Defaults to Depends(oauth2_scheme).
 
         Raises:
-            HTTPException: _description_
-            HTTPException: _description_
+            HTTPException: 401 if the token is invalid or expired
 
         Returns:
             _type_: _description_
         """
-        user_id = None
-        try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.jwt_algo])
-            if payload:
-                user_id = payload.get('public_id')
-        except JWTError:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
-                                detail="Invalid token")
-        return user_id
+        digest = self.claims_cache.digest(token)
+        payload = self.claims_cache.get(digest)
+        if payload is None:
+            try:
+                payload = self.decode_token(token)
+            except JWTError:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
+                                    detail="Invalid token")
+            self.claims_cache.put(digest, payload)
+        return payload.get('public_id') if payload else None
     
-    def get_reset_link(self, user_email: str):
+    async def get_reset_link(self, user_email: str, r: Redis):
         """_summary_
 
         Args:
             user_email (str): _description_
+            r (Redis): Shared async Redis client
 
         Returns:
             _type_: _description_
         """
         token = self.create_access_token(data={"email": user_email})
         reset_link = f"{os.getenv('FRONTEND_URL')}/reset-password?token={token}"
-        self.r.setex(f"reset_token:{token}", 930, user_email) 
+        await r.setex(f"reset_token:{token}", 930, user_email)
         return reset_link
 
-    def validate_reset_token(self, token: str):
+    async def validate_reset_token(self, token: str, r: Redis):
         """_summary_
 
         Args:
             token (str): _description_
+            r (Redis): Shared async Redis client
 
         Raises:
             HTTPException: _description_
@@ -116,13 +197,13 @@ class AuthUtils:
         Returns:
             _type_: _description_
         """
-        is_valid = self.r.get(f"reset_token:{token}")
+        is_valid = await r.get(f"reset_token:{token}")
         if not is_valid:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                                 detail="Reset link has expired. Kindly try")
         user_email = None 
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.jwt_algo])
+            payload = self.decode_token(token)
             if payload:
                 user_email = payload.get('email')
         except JWTError:
@@ -130,5 +211,5 @@ class AuthUtils:
                                 detail="Invalid token")
         return user_email
     
-    def delete_reset_token(self, token):
-        self.r.delete(f"reset_token:{token}")
\ No newline at end of file
+    async def delete_reset_token(self, token, r: Redis):
+        await r.delete(f"reset_token:{token}")
\ No newline at end of file
@@ -0,0 +1,566 @@
+import io
+import os
+import sys
+import asyncio
+import argparse
+import contextlib
+import statistics
+import subprocess
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+from scripts.compositing import composite_masked, composite_masked_reference
+from scripts.providers import FakeProvider, ProviderRouter
+
+
+def load_or_make_mask(mask_path: str, width: int, height: int) -> np.ndarray:
+    if mask_path:
+        mask = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
+        assert mask is not None and mask.shape[2] == 4, f"{mask_path} is not a 4 channel image"
+        return mask
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+
+def measure(fn, repeat: int) -> tuple:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed_ms, peak
+
+
+def bench_compositing(args):
+    mask = load_or_make_mask(args.mask, args.width, args.height)
+    height, width = mask.shape[:2]
+    image = np.random.default_rng(1).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    mask_rgb = np.ascontiguousarray(mask[:, :, :3])
+    alpha = np.ascontiguousarray(mask[:, :, 3])
+    print(f"Compositing {width}x{height}, {args.repeat} runs")
+    for name, fn in (("float64 (before)", lambda: composite_masked_reference(image, mask)),
+                     ("uint8 fused (after)", lambda: composite_masked(image, mask_rgb, alpha))):
+        elapsed_ms, peak = measure(fn, args.repeat)
+        print(f"{name:<22} {elapsed_ms:8.2f} ms/run   peak alloc {peak / 2**20:8.2f} MiB")
+    # The fused path works in OpenCV buffers; numpy temporaries showing up in
+    # the traced peak mean a regression to per-pixel float math
+    if peak / 2**20 > args.max_peak_mib:
+        print(f"❌ fused compositing peak {peak / 2**20:.2f} MiB exceeds {args.max_peak_mib} MiB")
+        sys.exit(1)
+    print(f"✅ fused compositing peak within {args.max_peak_mib} MiB")
+
+
+HEAVY_MODULES = ("cv2", "numpy", "boto3", "replicate", "cloudinary", "huggingface_hub", "PIL", "sympy")
+
+
+def parse_importtime(stderr: str) -> list:
+    """Parses ``python -X importtime`` output into (depth, self_us, cumulative_us, module)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, int(self_us), int(cumulative_us), name.strip()))
+    return rows
+
+
+def bench_startup(args):
+    totals = []
+    for _ in range(args.repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr.splitlines()[-1])
+            sys.exit(proc.returncode)
+        rows = parse_importtime(proc.stderr)
+        totals.append(sum(cumulative for depth, _, cumulative, _ in rows if depth == 0) / 1000)
+    total_ms = statistics.median(totals)
+    print(f"import {args.module}: {total_ms:.0f} ms (median of {args.repeat})")
+    print(f"{'slowest imports under ' + args.module:<40} {'cumulative ms':>14}")
+    first_level = sorted((row for row in rows if row[0] == 1), key=lambda row: row[2], reverse=True)
+    for _, _, cumulative, name in first_level[:args.top]:
+        print(f"{name:<40} {cumulative / 1000:>14.1f}")
+    heavy = sorted({name for _, _, _, name in rows if name in HEAVY_MODULES})
+    print(f"heavy modules imported: {', '.join(heavy) if heavy else 'none'}")
+    failed = False
+    if total_ms > args.max_ms:
+        print(f"❌ import time {total_ms:.0f} ms exceeds budget of {args.max_ms} ms")
+        failed = True
+    if args.forbid_heavy and heavy:
+        print("❌ heavy modules are imported at startup")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("✅ startup within budget")
+
+
+class SpikyProvider(FakeProvider):
+    """Fake provider whose latency spikes to ``spike`` seconds on a fraction
+    of the calls, the tail that hedging is meant to cut."""
+
+    def __init__(self, name: str, latency: float, spike: float, spike_rate: float, **kwargs) -> None:
+        super().__init__(name, latency, **kwargs)
+        self.base_latency = latency
+        self.spike = spike
+        self.spike_rate = spike_rate
+
+    async def generate(self, *args) -> list:
+        self.latency = self.spike if self.rng.random() < self.spike_rate else self.base_latency
+        return await super().generate(*args)
+
+
+async def run_router(router: ProviderRouter, requests: int) -> tuple:
+    latencies, failures = [], 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        if not await router.generate("benchmark", 64, 128, "9:16", 1):
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies), failures
+
+
+def bench_router(args):
+    scale = args.scale
+    scenarios = (
+        ("no hedging", dict(hedge_after=float("inf")), 0.0),
+        ("hedging (p95)", dict(), 0.0),
+        (f"primary failing {args.error_rate:.0%}", dict(), args.error_rate),
+    )
+    print(f"{args.requests} requests per scenario, latencies scaled by {scale}")
+    for name, router_kwargs, error_rate in scenarios:
+        primary = SpikyProvider("fast", 1.0 * scale, spike=8.0 * scale, spike_rate=args.spike_rate,
+                                jitter=0.2 * scale, error_rate=error_rate, seed=1)
+        secondary = FakeProvider("steady", 2.0 * scale, jitter=0.3 * scale, seed=2)
+        router = ProviderRouter([primary, secondary], default_hedge_after=3.0 * scale,
+                                cooldown=5.0 * scale, **router_kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies, failures = asyncio.run(run_router(router, args.requests))
+        p50 = latencies[len(latencies) // 2] / scale
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] / scale
+        stats = router.stats()
+        print(f"{name:<24} p50 {p50:5.2f}  p95 {p95:5.2f}  failures {failures}  "
+              f"hedges {stats['hedges']}  calls fast/steady {primary.calls}/{secondary.calls}  "
+              f"fast breaker trips {stats['providers']['fast']['trips']}")
+
+
+MASKED_MODELS_INDEX = "ix_phone_models_brand_id_mask_available"
+
+
+def explain(conn, query) -> str:
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+        return "\n".join(row[-1] for row in rows)
+    return "\n".join(row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}").all())
+
+
+def bench_catalog_plan(args):
+    """Seeds a throwaway catalog and checks that the catalog queries are
+    answered from the partial index. Runs against SQLite unless
+    ``--database-url`` points at a (disposable) Postgres database."""
+    import tempfile
+    from uuid import uuid4
+    from sqlalchemy import create_engine, insert, select
+    from app.models import Base, PhoneBrand, PhoneModel
+    from scripts.catalog import PhoneCatalog
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/catalog_plan.db"
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine, tables=[PhoneModel.__table__, PhoneBrand.__table__])
+    Base.metadata.create_all(engine, tables=[PhoneBrand.__table__, PhoneModel.__table__])
+    brand_ids = [uuid4() for _ in range(args.brands)]
+    with engine.begin() as conn:
+        conn.execute(insert(PhoneBrand), [{"id": brand_id, "name": f"Brand {i}"}
+                                          for i, brand_id in enumerate(brand_ids)])
+        conn.execute(insert(PhoneModel), [
+            {"id": uuid4(), "brand_id": brand_ids[i % args.brands], "name": f"Model {i}",
+             "phone_width": 70, "phone_height": 150, "mask_available": i % args.mask_every == 0}
+            for i in range(args.models)])
+        conn.exec_driver_sql("ANALYZE")
+    print(f"Seeded {args.models} models over {args.brands} brands, "
+          f"1 in {args.mask_every} with a mask ({engine.dialect.name})")
+    failed = False
+    with engine.connect() as conn:
+        before = select(PhoneBrand).join(PhoneModel, PhoneBrand.id == PhoneModel.brand_id) \
+            .where(PhoneModel.mask_available == True).distinct()
+        for name, query, expect_index in (("brands (join+DISTINCT)", before, False),
+                                          ("brands (EXISTS)", PhoneCatalog.brands_query(), True),
+                                          ("models of a brand", PhoneCatalog.models_query(brand_ids[0]), True),
+                                          ("all masked models", PhoneCatalog.models_query(), True)):
+            plan = explain(conn, query)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                conn.execute(query).all()
+            elapsed_ms = (time.perf_counter() - start) * 1000 / args.repeat
+            uses_index = MASKED_MODELS_INDEX in plan
+            failed |= expect_index and not uses_index
+            mark = ("✅" if uses_index else "❌") if expect_index else "  "
+            print(f"{mark} {name:<24} {elapsed_ms:8.2f} ms")
+            print("    " + plan.replace("\n", "\n    "))
+    engine.dispose()
+    if failed:
+        print(f"❌ {MASKED_MODELS_INDEX} is not used by every catalog query")
+        sys.exit(1)
+
+
+async def run_logins(hasher, hashed: str, logins: int, inline: bool) -> tuple:
+    """Verifies ``logins`` passwords concurrently while a ticker measures how
+    long the event loop is blocked. Returns (logins per second, max stall)."""
+    stalls = [0.0]
+    stop = asyncio.Event()
+
+    async def ticker():
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            stalls[0] = max(stalls[0], now - last - 0.005)
+            last = now
+
+    async def login():
+        if inline:
+            return hasher.context.verify_and_update("correct horse", hashed)
+        return await hasher.verify_and_update("correct horse", hashed)
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticking
+    assert all(valid for valid, _ in results)
+    return logins / elapsed, stalls[0]
+
+
+def bench_passwords(args):
+    from scripts.passwords import PasswordHasher, build_crypt_context
+    print(f"{args.logins} concurrent logins, {args.workers} hash workers")
+    for scheme in ("bcrypt", "argon2"):
+        context = build_crypt_context(scheme)
+        hashed = context.hash("correct horse")
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            context.verify("correct horse", hashed)
+        verify_ms = (time.perf_counter() - start) * 1000 / args.repeat
+        for inline in (True, False):
+            hasher = PasswordHasher(context, workers=args.workers)
+            rate, stall = asyncio.run(run_logins(hasher, hashed, args.logins, inline))
+            hasher.shutdown()
+            mode = "inline" if inline else "executor"
+            print(f"{scheme:<7} {mode:<9} verify {verify_ms:6.1f} ms  {rate:7.1f} logins/s  "
+                  f"max loop stall {stall * 1000:7.1f} ms")
+    # A bcrypt hash verified by the default (argon2) context is upgraded
+    legacy = build_crypt_context("bcrypt").hash("correct horse")
+    valid, new_hash = build_crypt_context("argon2").verify_and_update("correct horse", legacy)
+    upgraded = valid and new_hash is not None and new_hash.startswith("$argon2")
+    print(f"{'✅' if upgraded else '❌'} bcrypt hashes are rehashed with argon2 on login")
+    if not upgraded:
+        sys.exit(1)
+
+
+def bench_auth(args):
+    """Per-request cost of resolving the user of a bearer token, with and
+    without the verified-claims cache, plus a key rotation check."""
+    import os
+    from fastapi import HTTPException
+    from scripts.auth import AuthUtils, ClaimsCache
+    os.environ.setdefault("JWT_ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "15")
+    os.environ["JWT_SIGNING_KEYS"] = "2024:old-secret,2025:new-secret"
+    os.environ["JWT_ACTIVE_KID"] = "2024"
+    old = AuthUtils()
+    os.environ["JWT_ACTIVE_KID"] = "2025"
+    auth_utils = AuthUtils()
+    tokens = [auth_utils.create_access_token({"public_id": f"user-{i}"}) for i in range(args.clients)]
+    for label, cache in (("uncached", ClaimsCache(max_entries=0)), ("claims cache", ClaimsCache())):
+        auth_utils.claims_cache = cache
+        start = time.perf_counter()
+        for i in range(args.requests):
+            auth_utils.get_current_user_id(tokens[i % args.clients])
+        per_request_us = (time.perf_counter() - start) * 1e6 / args.requests
+        print(f"{label:<13} {per_request_us:7.2f} µs per request  {cache.stats()}")
+    checks = []
+    checks.append(("token signed with the previous key is accepted",
+                   auth_utils.get_current_user_id(old.create_access_token({"public_id": "u"})) == "u"))
+    auth_utils.signing_keys.pop("2024")
+    try:
+        auth_utils.get_current_user_id(old.create_access_token({"public_id": "v"}))
+        checks.append(("token of a retired key is rejected", False))
+    except HTTPException:
+        checks.append(("token of a retired key is rejected", True))
+    expiring = auth_utils.create_access_token({"public_id": "w"}, exp_min=-1)
+    try:
+        auth_utils.get_current_user_id(expiring)
+        checks.append(("expired token is rejected", False))
+    except HTTPException:
+        checks.append(("expired token is rejected", True))
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+    if not all(ok for _, ok in checks):
+        sys.exit(1)
+
+
+def read_rss_kb() -> int:
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+
+
+async def fake_upscale_output(size: int, chunk_size: int):
+    """Stands in for a Replicate FileOutput: fresh chunks like an HTTP body."""
+    sent = 0
+    while sent < size:
+        chunk = os.urandom(min(chunk_size, size - sent))
+        sent += len(chunk)
+        yield chunk
+
+
+def run_upload(args) -> dict:
+    from scripts.storage import LocalStorage, S3Storage
+    if args.endpoint_url:
+        os.environ["S3_ENDPOINT_URL"] = args.endpoint_url
+        storage = S3Storage(bucket=args.bucket)
+        with contextlib.suppress(Exception):
+            storage.s3.create_bucket(Bucket=args.bucket)
+    else:
+        import tempfile
+        storage = LocalStorage(root=tempfile.mkdtemp())
+    size = int(args.size_mb * 1024 * 1024)
+    chunks = fake_upscale_output(size, args.chunk_kb * 1024)
+    key = f"benchmark_{args.mode}"
+
+    async def upload():
+        if args.mode == "buffered":
+            # The previous upscale_image: read the whole output, then upload
+            return await storage.upload(key, b"".join([chunk async for chunk in chunks]))
+        return await storage.upload_stream(key, chunks)
+
+    baseline = read_rss_kb()
+    import resource
+    start = time.perf_counter()
+    asyncio.run(upload())
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    uploaded = len(storage.get_object(key)[0])
+    storage.shutdown()
+    return {"mode": args.mode, "seconds": round(elapsed, 2), "peak_rss_delta_mb": round((peak - baseline) / 1024, 1),
+            "part_mb": storage.part_size / 1024 / 1024, "concurrency": storage.upload_concurrency,
+            "ok": uploaded == size}
+
+
+def bench_upload_stream(args):
+    """Peak RSS of uploading one upscaled image, buffered vs streamed. Each
+    mode runs in a fresh interpreter so their peaks do not mix. Fails when
+    the streamed peak is above the parts in flight, the one being filled and
+    the one being split, plus ``--slack-mb`` of interpreter overhead; the
+    object must be larger than that bound for the check to mean anything."""
+    import json
+    if args.mode:
+        print(json.dumps(run_upload(args)))
+        return
+    target = args.endpoint_url or "local storage"
+    print(f"{args.size_mb} MB upscale output in {args.chunk_kb} KB chunks to {target}")
+    failed = False
+    for mode in ("buffered", "streamed"):
+        command = [sys.executable, "-m", "scripts.benchmarks", "upload-stream", "--mode", mode,
+                   "--size-mb", str(args.size_mb), "--chunk-kb", str(args.chunk_kb), "--bucket", args.bucket]
+        if args.endpoint_url:
+            command += ["--endpoint-url", args.endpoint_url]
+        result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+        ok = result["ok"]
+        if mode == "streamed":
+            bound_mb = (result["concurrency"] + 2) * result["part_mb"] + args.slack_mb
+            if args.size_mb <= bound_mb:
+                print(f"❌ --size-mb {args.size_mb} is not above the streamed bound of {bound_mb:.0f} MB")
+                ok = False
+            ok = ok and result["peak_rss_delta_mb"] <= bound_mb
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {mode:<9} {result['seconds']:6.2f} s  "
+              f"peak RSS +{result['peak_rss_delta_mb']:6.1f} MB  "
+              f"(part {result['part_mb']:.0f} MB x {result['concurrency']} in flight)"
+              + (f", bound {bound_mb:.0f} MB" if mode == "streamed" else ""))
+    if failed:
+        sys.exit(1)
+
+
+def make_generated_image(width: int, height: int) -> bytes:
+    """Smooth gradients with some texture, closer to a FLUX output than noise."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack([128 + 100 * np.sin(x / 37 + y / 91), 128 + 100 * np.cos(y / 53),
+                      128 + 60 * np.sin((x + y) / 23)], axis=-1)
+    image += np.random.default_rng(0).normal(0, 6, image.shape)
+    success, encoded = cv2.imencode(".png", np.clip(image, 0, 255).astype(np.uint8))
+    return encoded.tobytes()
+
+
+async def run_local_upscales(upscaler, img_bytes: bytes, images: int, scale: int) -> tuple:
+    await upscaler.upscale_bytes(img_bytes, scale)  # start the pool
+    start = time.perf_counter()
+    outputs = await asyncio.gather(*(upscaler.upscale_bytes(img_bytes, scale) for _ in range(images)))
+    return time.perf_counter() - start, len(outputs[0])
+
+
+async def run_remote_upscales(image_url: str, images: int, scale: int) -> tuple:
+    from scripts.upscalers import ReplicateUpscaler
+    upscaler = ReplicateUpscaler()
+    start = time.perf_counter()
+    outputs = await asyncio.gather(*(upscaler.upscale(image_url, scale) for _ in range(images)))
+    sizes = await asyncio.gather(*(output.aread() for output in outputs))
+    return time.perf_counter() - start, len(sizes[0])
+
+
+def bench_upscale(args):
+    """Throughput of the local upscaler on its process pool, and of the
+    Replicate Real-ESRGAN path when ``--image-url`` and a token are given."""
+    from scripts.upscalers import LanczosUpscaler
+    img_bytes = make_generated_image(args.width, args.height)
+    out_w, out_h = args.width * args.scale, args.height * args.scale
+    print(f"{args.images} images {args.width}x{args.height} -> {out_w}x{out_h}")
+    for workers in sorted({1, args.workers}):
+        upscaler = LanczosUpscaler(workers=workers)
+        elapsed, size = asyncio.run(run_local_upscales(upscaler, img_bytes, args.images, args.scale))
+        upscaler.shutdown()
+        print(f"lanczos   {workers:>2} workers  {args.images / elapsed:6.2f} images/s  "
+              f"{elapsed / args.images * 1000:8.0f} ms/image  output {size / 1e6:.1f} MB")
+    if not (args.image_url and os.getenv("REPLICATE_API_TOKEN")):
+        print("replicate skipped (needs --image-url and REPLICATE_API_TOKEN)")
+        return
+    elapsed, size = asyncio.run(run_remote_upscales(args.image_url, args.images, args.scale))
+    print(f"replicate {args.images:>2} concurrent {args.images / elapsed:6.2f} images/s  "
+          f"{elapsed:8.1f} s wall  output {size / 1e6:.1f} MB")
+
+
+def make_phone_mask(width: int, height: int) -> np.ndarray:
+    """BGRA mask shaped like a phone back: an opaque rounded rectangle with a
+    transparent camera cutout, for runs without ``--mask``."""
+    mask = np.zeros((height, width, 4), np.uint8)
+    radius = width // 8
+    cv2.rectangle(mask, (radius, 0), (width - radius, height), (255, 255, 255, 255), -1)
+    cv2.rectangle(mask, (0, radius), (width, height - radius), (255, 255, 255, 255), -1)
+    for x, y in ((radius, radius), (width - radius, radius), (radius, height - radius),
+                 (width - radius, height - radius)):
+        cv2.circle(mask, (x, y), radius, (255, 255, 255, 255), -1, cv2.LINE_AA)
+    cv2.rectangle(mask, (width // 12, width // 12), (width // 2, width // 2), (0, 0, 0, 0), -1)
+    return mask
+
+
+def bench_encoders(args):
+    """Encode time and size of every output format on composited previews."""
+    from scripts.encoders import OUTPUT_FORMATS
+    masks = {path: load_or_make_mask(path, args.width, args.height) for path in args.mask} or \
+        {"synthetic phone mask": make_phone_mask(args.width, args.height)}
+    for label, mask in masks.items():
+        height, width = mask.shape[:2]
+        image = cv2.imdecode(np.frombuffer(make_generated_image(width, height), np.uint8), cv2.IMREAD_COLOR)
+        composite = composite_masked(image, np.ascontiguousarray(mask[:, :, :3]),
+                                     np.ascontiguousarray(mask[:, :, 3])).copy()
+        print(f"{label}: {width}x{height} BGRA, median of {args.repeat} runs")
+        baseline = None
+        for name, fmt in OUTPUT_FORMATS.items():
+            if not fmt.available():
+                print(f"  {name:<14} not supported by this OpenCV build")
+                continue
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                encoded = fmt.encode(composite)
+                timings.append((time.perf_counter() - start) * 1000)
+            size = len(encoded)
+            baseline = baseline or size
+            print(f"  {name:<14} {statistics.median(timings):8.1f} ms  {size / 1e6:7.2f} MB  "
+                  f"{size / baseline:6.0%} of png  {'lossless' if fmt.lossless else 'lossy'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CaseCraft micro benchmarks")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    compositing = subparsers.add_parser("compositing", help="mask compositing time and peak memory")
+    compositing.add_argument("--mask", default="", help="path to a BGRA mask PNG, synthetic if omitted")
+    compositing.add_argument("--width", type=int, default=896)
+    compositing.add_argument("--height", type=int, default=1904)
+    compositing.add_argument("--repeat", type=int, default=20)
+    compositing.add_argument("--max-peak-mib", type=float, default=1.0,
+                             help="fail when the fused path's traced peak allocation exceeds this")
+    compositing.set_defaults(func=bench_compositing)
+
+    startup = subparsers.add_parser("startup", help="import time of the app, fails above a budget")
+    startup.add_argument("--module", default="app.main")
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.add_argument("--top", type=int, default=15)
+    startup.add_argument("--max-ms", type=float, default=1500)
+    startup.add_argument("--forbid-heavy", action="store_true",
+                         help=f"fail if any of {', '.join(HEAVY_MODULES)} is imported")
+    startup.set_defaults(func=bench_startup)
+
+    router = subparsers.add_parser("router", help="provider router with fake providers: hedging and breaker")
+    router.add_argument("--requests", type=int, default=200)
+    router.add_argument("--spike-rate", type=float, default=0.1,
+                        help="fraction of primary calls with an 8x latency spike")
+    router.add_argument("--error-rate", type=float, default=0.8)
+    router.add_argument("--scale", type=float, default=0.01, help="seconds per simulated latency unit")
+    router.set_defaults(func=bench_router)
+
+    catalog_plan = subparsers.add_parser("catalog-plan",
+                                         help="seed a catalog and assert the queries use the partial index")
+    catalog_plan.add_argument("--database-url", default="",
+                              help="sync SQLAlchemy URL of a disposable database, temporary SQLite if omitted")
+    catalog_plan.add_argument("--models", type=int, default=50000)
+    catalog_plan.add_argument("--brands", type=int, default=200)
+    catalog_plan.add_argument("--mask-every", type=int, default=20)
+    catalog_plan.add_argument("--repeat", type=int, default=5)
+    catalog_plan.set_defaults(func=bench_catalog_plan)
+
+    passwords = subparsers.add_parser("passwords",
+                                      help="bcrypt vs argon2 login throughput and event loop stalls")
+    passwords.add_argument("--logins", type=int, default=32)
+    passwords.add_argument("--workers", type=int, default=2)
+    passwords.add_argument("--repeat", type=int, default=10)
+    passwords.set_defaults(func=bench_passwords)
+
+    auth = subparsers.add_parser("auth", help="bearer token verification cost with and without the claims cache")
+    auth.add_argument("--requests", type=int, default=20000)
+    auth.add_argument("--clients", type=int, default=100, help="distinct tokens polling concurrently")
+    auth.set_defaults(func=bench_auth)
+
+    upload_stream = subparsers.add_parser("upload-stream",
+                                          help="peak RSS of an upscale upload, buffered vs multipart stream")
+    upload_stream.add_argument("--size-mb", type=float, default=256)
+    upload_stream.add_argument("--slack-mb", type=float, default=16,
+                               help="allowance above the parts held in memory for interpreter and threads")
+    upload_stream.add_argument("--chunk-kb", type=int, default=64)
+    upload_stream.add_argument("--endpoint-url", default="",
+                               help="S3 compatible endpoint, e.g. a local moto_server or MinIO; "
+                                    "local storage if omitted")
+    upload_stream.add_argument("--bucket", default="casecraft-benchmark")
+    upload_stream.add_argument("--mode", choices=("buffered", "streamed"), help=argparse.SUPPRESS)
+    upload_stream.set_defaults(func=bench_upload_stream)
+
+    upscale = subparsers.add_parser("upscale", help="local CPU upscaler throughput vs the Replicate upscaler")
+    upscale.add_argument("--width", type=int, default=896)
+    upscale.add_argument("--height", type=int, default=1904)
+    upscale.add_argument("--scale", type=int, default=2)
+    upscale.add_argument("--images", type=int, default=8)
+    upscale.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    upscale.add_argument("--image-url", default="", help="public image to upscale remotely")
+    upscale.set_defaults(func=bench_upscale)
+
+    encoders = subparsers.add_parser("encoders", help="encode time and size of each output format")
+    encoders.add_argument("--mask", nargs="*", default=[], help="BGRA mask PNGs, a synthetic phone mask if omitted")
+    encoders.add_argument("--width", type=int, default=896)
+    encoders.add_argument("--height", type=int, default=1904)
+    encoders.add_argument("--repeat", type=int, default=3)
+    encoders.set_defaults(func=bench_encoders)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
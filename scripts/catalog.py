@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import exists, select
+from redis.asyncio import Redis
+
+from app.models import PhoneBrand, PhoneModel
+from scripts.render_profiles import RenderProfile, compute_pixels_and_ratios, mask_key
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def bump_catalog_version() -> int:
+    """Tells every API process to reload the phone catalog. Called by the
+    scripts that change brands, models or mask availability."""
+    import redis
+    r = redis.Redis(host=os.getenv("REDIS_SERVER", "localhost"), port=int(os.getenv("REDIS_PORT", 6379)))
+    try:
+        version = r.incr(CATALOG_VERSION_KEY)
+    finally:
+        r.close()
+    print(f"✅ Phone catalog version bumped to {version}")
+    return version  # type: ignore
+
+
+class CatalogEntry:
+    """Pre-serialized JSON body of one catalog endpoint with its strong ETag."""
+
+    def __init__(self, payload: list) -> None:
+        self.body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Evaluates an ``If-None-Match`` header (weak comparison, RFC 9110)."""
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+
+class PhoneCatalog:
+    """In-memory snapshot of the brands and models that have a mask, and of
+    the render profile of each such model.
+
+    The snapshot is built with a single query and kept until the catalog
+    version in Redis changes (see ``bump_catalog_version``), which is checked
+    at most every ``CATALOG_VERSION_CHECK_SECONDS``. As a safety net for
+    edits made outside the scripts it is also rebuilt after
+    ``CATALOG_MAX_AGE_SECONDS``.
+    """
+
+    def __init__(self, session_factory, check_interval: Optional[float] = None,
+                 max_age: Optional[float] = None) -> None:
+        self.session_factory = session_factory
+        self.check_interval = check_interval if check_interval is not None else \
+            float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", 5))
+        self.max_age = max_age if max_age is not None else float(os.getenv("CATALOG_MAX_AGE_SECONDS", 3600))
+        self.version: Optional[str] = None
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+        self.brands: Optional[CatalogEntry] = None
+        self.models = {}
+        self.profiles = {}
+        self.empty = CatalogEntry([])
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+
+    @staticmethod
+    def brands_query():
+        """Brands with at least one masked model, as a column-only EXISTS
+        probe answered from ix_phone_models_brand_id_mask_available."""
+        has_mask = exists().where(PhoneModel.brand_id == PhoneBrand.id, PhoneModel.mask_available == True)
+        return select(PhoneBrand.id, PhoneBrand.name).where(has_mask).order_by(PhoneBrand.name)
+
+    @staticmethod
+    def models_query(brand_id=None):
+        query = select(PhoneModel.brand_id, PhoneModel.id, PhoneModel.name, PhoneModel.phone_width,
+                       PhoneModel.phone_height, PhoneModel.pixel_width, PhoneModel.pixel_height,
+                       PhoneModel.aspect_ratio, PhoneModel.mask_key, PhoneModel.mask_etag) \
+            .where(PhoneModel.mask_available == True)
+        if brand_id is not None:
+            query = query.where(PhoneModel.brand_id == brand_id)
+        return query.order_by(PhoneModel.brand_id, PhoneModel.name)
+
+    async def load(self, version: Optional[str]) -> None:
+        async with self.session_factory() as session:
+            brand_rows = (await session.execute(self.brands_query())).all()
+            model_rows = (await session.execute(self.models_query())).all()
+        models = {}
+        for row in model_rows:
+            models.setdefault(str(row.brand_id), []).append({"id": str(row.id), "name": row.name})
+        self.profiles = self.build_profiles(model_rows)
+        self.brands = CatalogEntry([{"id": str(brand_id), "name": name} for brand_id, name in brand_rows])
+        self.models = {brand_id: CatalogEntry(payload) for brand_id, payload in models.items()}
+        self.version = version
+        self.loaded_at = self.checked_at = time.monotonic()
+        self.reloads += 1
+
+    @staticmethod
+    def build_profiles(model_rows: list) -> dict:
+        """Maps model id to its RenderProfile. Rows not profiled yet (before
+        ``python -m scripts.render_profiles`` ran) are computed in one batch."""
+        missing = [row for row in model_rows if row.pixel_width is None or row.aspect_ratio is None]
+        computed = {}
+        if missing:
+            widths, heights, ratios = compute_pixels_and_ratios([row.phone_width for row in missing],
+                                                                [row.phone_height for row in missing])
+            computed = {row.id: values for row, *values in zip(missing, widths, heights, ratios)}
+        profiles = {}
+        for row in model_rows:
+            pixel_width, pixel_height, aspect_ratio = computed.get(
+                row.id, (row.pixel_width, row.pixel_height, row.aspect_ratio))
+            profiles[str(row.id)] = RenderProfile(row.id, row.brand_id, pixel_width, pixel_height, aspect_ratio,
+                                                  row.mask_key or mask_key(row.brand_id, row.id), row.mask_etag)
+        return profiles
+
+    async def refresh(self, r: Redis) -> None:
+        """Reloads the snapshot if it is missing, stale or its version changed.
+        Concurrent requests wait on a single reload."""
+        now = time.monotonic()
+        if self.brands is not None and now - self.checked_at < self.check_interval \
+                and now - self.loaded_at < self.max_age:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self.brands is not None and now - self.checked_at < self.check_interval \
+                    and now - self.loaded_at < self.max_age:
+                return
+            version = await r.get(CATALOG_VERSION_KEY)
+            if self.brands is None or version != self.version or now - self.loaded_at >= self.max_age:
+                await self.load(version)
+            else:
+                self.checked_at = now
+
+    async def get_brands(self, r: Redis) -> CatalogEntry:
+        await self.refresh(r)
+        return self.brands  # type: ignore
+
+    async def get_models(self, r: Redis, brand_id: str) -> CatalogEntry:
+        await self.refresh(r)
+        try:
+            brand_id = str(UUID(brand_id))
+        except ValueError:
+            return self.empty
+        return self.models.get(brand_id, self.empty)
+
+    async def get_profile(self, r: Redis, model_id: str) -> Optional[RenderProfile]:
+        """Render profile of a phone model with a mask, None if unknown."""
+        await self.refresh(r)
+        try:
+            model_id = str(UUID(model_id))
+        except ValueError:
+            return None
+        return self.profiles.get(model_id)
+
+    def stats(self) -> dict:
+        return {"version": self.version, "reloads": self.reloads, "brands": len(self.models),
+                "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None}
@@ -0,0 +1,50 @@
+import os
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy.future import select
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+load_dotenv()
+
+
+from app.models import PhoneModel
+from scripts.mask_store import MaskStore
+from scripts.storage import get_storage
+
+
+class MaskCompiler:
+    """Downloads every available mask from storage and writes it to the local
+    MaskStore in the precompiled format used by Utils.handle_generation."""
+
+    def __init__(self) -> None:
+        self.storage = get_storage()
+        DATABASE_URL = os.getenv("EC2_SYNC_DATABASE_URL")
+        assert DATABASE_URL is not None, "Database url missing"
+        engine = create_engine(DATABASE_URL)
+        self.session = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+        self.store = MaskStore()
+
+    def get_masked_phone_models(self):
+        with self.session() as session:
+            query_result = session.execute(
+                select(PhoneModel.id, PhoneModel.brand_id).where(PhoneModel.mask_available == True)
+            )
+            phone_models = query_result.all()
+        return phone_models
+
+    def compile_all(self):
+        phone_models = self.get_masked_phone_models()
+        for model_id, brand_id in phone_models:
+            img_bytes, etag = self.storage.get_object(f"Masks/{brand_id}/{model_id}")
+            mask = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_UNCHANGED)
+            if mask is None or mask.ndim != 3 or mask.shape[2] != 4:
+                print(f"Skipping {model_id}: mask is not a 4 channel PNG")
+                continue
+            self.store.save(brand_id, model_id, mask, etag)
+            print(f"Compiled mask for {model_id}")
+        print(f"✅ Compiled masks written to {self.store.root}")
+
+
+if __name__ == "__main__":
+    MaskCompiler().compile_all()
@@ -0,0 +1,93 @@
+import os
+from typing import NamedTuple, Optional
+
+# cv2 is only imported when encoding, the web tier picks formats by name
+# without loading it. Parameters are given as cv2 constant names.
+
+
+class OutputFormat(NamedTuple):
+    name: str
+    extension: str
+    content_type: str
+    params: tuple = ()
+    alpha: bool = True
+    lossless: bool = True
+
+    def cv2_params(self) -> list:
+        import cv2
+        return [value for name, setting in self.params for value in (getattr(cv2, name), setting)]
+
+    def available(self) -> bool:
+        import cv2
+        return cv2.haveImageWriter(self.extension) and all(hasattr(cv2, name) for name, _ in self.params)
+
+    def encode(self, image) -> Optional[bytes]:
+        """Encodes a BGR or BGRA uint8 image. Formats without alpha get the
+        transparent areas flattened onto white."""
+        import cv2
+        if not self.alpha and image.ndim == 3 and image.shape[2] == 4:
+            image = flatten_alpha(image)
+        success, encoded = cv2.imencode(self.extension, image, self.cv2_params())
+        return encoded.tobytes() if success else None
+
+
+def flatten_alpha(image, background: int = 255):
+    import numpy as np
+    alpha = image[..., 3:4].astype(np.uint16)
+    flat = (image[..., :3] * alpha + background * (255 - alpha) + 127) // 255
+    return flat.astype(np.uint8)
+
+
+OUTPUT_FORMATS = {fmt.name: fmt for fmt in (
+    # OpenCV defaults (zlib level 1), what the service always produced
+    OutputFormat("png", ".png", "image/png"),
+    OutputFormat("png-6", ".png", "image/png", (("IMWRITE_PNG_COMPRESSION", 6),)),
+    OutputFormat("png-9", ".png", "image/png", (("IMWRITE_PNG_COMPRESSION", 9),)),
+    OutputFormat("png-filtered", ".png", "image/png",
+                 (("IMWRITE_PNG_COMPRESSION", 6), ("IMWRITE_PNG_STRATEGY", 1))),  # Z_FILTERED
+    # Quality above 100 selects lossless WebP
+    OutputFormat("webp-lossless", ".webp", "image/webp", (("IMWRITE_WEBP_QUALITY", 101),)),
+    OutputFormat("webp", ".webp", "image/webp", (("IMWRITE_WEBP_QUALITY", 90),), lossless=False),
+    OutputFormat("jpeg", ".jpg", "image/jpeg",
+                 (("IMWRITE_JPEG_QUALITY", 92), ("IMWRITE_JPEG_OPTIMIZE", 1)), alpha=False, lossless=False),
+    OutputFormat("avif", ".avif", "image/avif", (("IMWRITE_AVIF_QUALITY", 80), ("IMWRITE_AVIF_SPEED", 8)),
+                 lossless=False),
+)}
+
+
+def get_output_format(name: str) -> OutputFormat:
+    """Looks up a preset of OUTPUT_FORMATS.
+
+    Raises:
+        ValueError: Unknown format name
+    """
+    try:
+        return OUTPUT_FORMATS[name]
+    except KeyError:
+        raise ValueError(f"Unknown output format {name}, expected one of {', '.join(OUTPUT_FORMATS)}")
+
+
+# Preview encoding per endpoint family, checked by ``check_output_formats``
+# in the app lifespan
+ANON_OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT_ANON", "png")
+USER_OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT_USER", "png")
+
+
+def check_output_formats(*names: str) -> None:
+    """Encodes a small BGRA image with each format, so a misconfigured or
+    unsupported format (e.g. avif on an OpenCV build without the writer)
+    fails at startup rather than after the provider was paid.
+
+    Raises:
+        ValueError: Unknown format name, or the local cv2 cannot encode it
+    """
+    import numpy as np
+    sample = np.zeros((16, 16, 4), np.uint8)
+    for name in names:
+        output_format = get_output_format(name)
+        try:
+            encoded = output_format.encode(sample) if output_format.available() else None
+        except Exception as err:
+            raise ValueError(f"Output format {name} failed to encode: {err}") from err
+        if not encoded:
+            raise ValueError(f"Output format {name} is not supported by this OpenCV build")
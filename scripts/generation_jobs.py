@@ -0,0 +1,136 @@
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+from fastapi import HTTPException
+from redis.asyncio import Redis
+
+GEN_JOB_TTL_SECONDS = 86400
+TERMINAL_STAGES = ("failed",)
+UPSCALE_STAGES = ("upscaled", "upscale_failed")
+
+
+def job_key(job_id: str) -> str:
+    return f"gen_job:{job_id}"
+
+
+def events_key(job_id: str) -> str:
+    return f"gen_job_events:{job_id}"
+
+
+def add_event(pipe, key: str, stage: str, data: Optional[dict] = None) -> None:
+    """Queues an XADD of a stage transition on a pipeline (or client)."""
+    pipe.xadd(key, {"stage": stage, "data": json.dumps(data or {})})
+    pipe.expire(key, GEN_JOB_TTL_SECONDS)
+
+
+async def create_job(r: Redis) -> str:
+    job_id = str(uuid4())
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(job_key(job_id), mapping={"status": "queued"})
+        pipe.expire(job_key(job_id), GEN_JOB_TTL_SECONDS)
+        add_event(pipe, events_key(job_id), "queued")
+        await pipe.execute()
+    return job_id
+
+
+async def publish_stage(r: Redis, job_id: str, stage: str, data: Optional[dict] = None) -> None:
+    """Records a stage transition on the job record and its event stream.
+
+    Args:
+        r (Redis): Shared async Redis client
+        job_id (str): Generation job id
+        stage (str): One of queued, generating, compositing, uploaded, failed
+        data (Optional[dict], optional): Stage payload, stored as the job
+            result when present. Defaults to None.
+    """
+    async with r.pipeline(transaction=True) as pipe:
+        mapping = {"status": stage}
+        if data:
+            mapping["result"] = json.dumps(data)
+        pipe.hset(job_key(job_id), mapping=mapping)
+        add_event(pipe, events_key(job_id), stage, data)
+        await pipe.execute()
+
+
+async def get_job(r: Redis, job_id: str) -> Optional[dict]:
+    job = await r.hgetall(job_key(job_id))
+    if not job:
+        return None
+    return {"job_id": job_id, "status": job.get("status"), "result": json.loads(job.get("result", "{}"))}
+
+
+async def run_generation_job(utils, r: Redis, job_id: str, **generation_kwargs) -> None:
+    """Runs Utils.handle_generation for a submitted job, reporting each stage.
+
+    Errors are recorded as a ``failed`` event instead of being raised, since
+    nobody awaits the task that runs this. A job cancelled at shutdown is
+    recorded as failed too, so its event stream does not wait for it.
+    """
+    async def progress(stage: str, data: Optional[dict] = None):
+        await publish_stage(r, job_id, stage, data)
+
+    try:
+        await utils.handle_generation(r=r, progress=progress, upscale_events_key=events_key(job_id),
+                                      **generation_kwargs)
+    except HTTPException as err:
+        await publish_stage(r, job_id, "failed", {"detail": err.detail})
+    except asyncio.CancelledError:
+        try:
+            await asyncio.shield(publish_stage(r, job_id, "failed",
+                                               {"detail": "Generation was interrupted. Kindly try again"}))
+        except Exception as err:
+            print(f"Could not record the interruption of generation job {job_id}: {err}")
+        raise
+    except Exception as err:
+        print(f"Generation job {job_id} failed: {err}")
+        await publish_stage(r, job_id, "failed", {"detail": "Error while generating the image. Kindly try again"})
+
+
+def _finished_images(entries: list) -> set:
+    """Image uuids reported ``upscaled`` or ``upscale_failed`` by ``entries``."""
+    return {img_uuid for _, fields in entries if fields["stage"] in UPSCALE_STAGES
+            for img_uuid in json.loads(fields["data"])}
+
+
+async def stream_events(r: Redis, job_id: str, last_event_id: str = "0",
+                        heartbeat_ms: int = 15000) -> AsyncIterator[str]:
+    """Yields the job's stage transitions as server-sent events.
+
+    Events are read from a Redis Stream, so a client reconnecting with
+    ``Last-Event-ID`` resumes where it left off. The stream ends after
+    ``failed``, once every image of the job result reported ``upscaled`` or
+    ``upscale_failed`` (in whatever order the events arrive), or once the
+    events expired.
+    """
+    key = events_key(job_id)
+    job = await get_job(r, job_id)
+    if job is None:
+        return
+    # Upscale events the client already received before reconnecting
+    finished = _finished_images(await r.xrange(key, "-", last_event_id)) if last_event_id != "0" else set()
+    while True:
+        # Images of the job still to report, known once it reached ``uploaded``
+        expected = set(job["result"]) if job["status"] == "uploaded" else None
+        if expected is not None and expected <= finished:
+            return
+        # A failed job has recorded all its events, nothing is left to wait for
+        failed = job["status"] in TERMINAL_STAGES
+        response = await r.xread({key: last_event_id}, count=100, block=None if failed else heartbeat_ms)
+        if not response:
+            job = await get_job(r, job_id)
+            if failed or job is None or not await r.exists(key):
+                return
+            if job["status"] not in TERMINAL_STAGES:
+                yield ": keep-alive\n\n"
+            continue
+        entries = response[0][1]
+        for event_id, fields in entries:
+            last_event_id = event_id
+            stage = fields["stage"]
+            yield f"id: {event_id}\nevent: {stage}\ndata: {fields['data']}\n\n"
+            if stage in TERMINAL_STAGES:
+                return
+            if stage == "uploaded":
+                job = {**job, "status": stage, "result": json.loads(fields["data"])}
+        finished |= _finished_images(entries)
@@ -0,0 +1,276 @@
+import os
+import atexit
+import asyncio
+import threading
+import weakref
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+from uuid import UUID
+import cv2
+import numpy as np
+
+from scripts.compositing import composite_masked
+from scripts.encoders import get_output_format
+from scripts.mask_store import MaskStore
+
+
+def render_case_image(img_bytes: bytes, mask_rgb: np.ndarray, alpha: np.ndarray,
+                      output_format: str = "png") -> Optional[bytes]:
+    """Decodes a generated image, fits it to the mask and encodes the result.
+
+    Args:
+        img_bytes (bytes): Encoded image returned by the generation provider
+        mask_rgb (np.ndarray): uint8 BGR channels of the mask
+        alpha (np.ndarray): uint8 alpha channel of the mask
+        output_format (str, optional): Preset of scripts.encoders.OUTPUT_FORMATS.
+            Defaults to "png".
+
+    Returns:
+        Optional[bytes]: Encoded image, or None if the image could not be processed
+    """
+    image = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    image = cv2.resize(image, (alpha.shape[1], alpha.shape[0]), interpolation=cv2.INTER_LANCZOS4)
+    masked_image = composite_masked(image, mask_rgb, alpha)
+    return get_output_format(output_format).encode(masked_image)
+
+
+# Worker side: masks attached by this process, least recently used first,
+# keyed by (kind, brand_id, model_id) -> (mask_ref, arrays, segments)
+_attached_masks = OrderedDict()
+_attached_bytes = 0
+SHARED_MASK_MAX_BYTES = int(os.getenv("IMAGE_PIPELINE_SHARED_MASK_MAX_BYTES", 256 * 1024 * 1024))
+
+
+def _detach(key: tuple) -> None:
+    global _attached_bytes
+    _, arrays, segments = _attached_masks.pop(key)
+    _attached_bytes -= sum(array.nbytes for array in arrays)
+    # Drop the views first, a segment cannot be closed while they exist
+    del arrays
+    for shm in segments:
+        try:
+            shm.close()
+        except BufferError:
+            # Still viewed by a running render, unmapped once it is collected
+            pass
+
+
+def _resolve_mask(mask_ref: tuple) -> tuple:
+    """Turns a mask reference sent by the parent into arrays inside a worker.
+
+    ``("store", brand_id, model_id, root, version)`` memory-maps the compiled
+    mask from the local MaskStore; ``("shm", brand_id, model_id, (name, shape),
+    (name, shape))`` attaches to shared memory segments published by the
+    parent. Attachments map pages shared with the parent and the other
+    workers. They are kept in an LRU bounded by
+    ``IMAGE_PIPELINE_SHARED_MASK_MAX_BYTES`` so repeated requests for a model
+    are free, and a reference with another version or segment replaces the
+    previous attachment of its model.
+    """
+    global _attached_bytes
+    key = mask_ref[:3]
+    entry = _attached_masks.get(key)
+    if entry is not None:
+        if entry[0] == mask_ref:
+            _attached_masks.move_to_end(key)
+            return entry[1]
+        _detach(key)
+    if mask_ref[0] == "store":
+        _, brand_id, model_id, root, _ = mask_ref
+        arrays = MaskStore(root).load(brand_id, model_id)
+        if arrays is None:
+            raise FileNotFoundError(f"Compiled mask of {model_id} is missing from {root}")
+        segments = ()
+    else:
+        segments = tuple(shared_memory.SharedMemory(name=name) for name, _ in mask_ref[3:])
+        arrays = tuple(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+                       for shm, (_, shape) in zip(segments, mask_ref[3:]))
+    _attached_masks[key] = (mask_ref, arrays, segments)
+    _attached_bytes += sum(array.nbytes for array in arrays)
+    while _attached_bytes > SHARED_MASK_MAX_BYTES and len(_attached_masks) > 1:
+        _detach(next(iter(_attached_masks)))
+    return arrays
+
+
+def _render_in_worker(img_bytes: bytes, mask_ref: tuple, output_format: str) -> Optional[bytes]:
+    mask_rgb, alpha = _resolve_mask(mask_ref)
+    return render_case_image(img_bytes, mask_rgb, alpha, output_format)
+
+
+class _SharedMask:
+    """Mask published by the parent into shared memory. Its segments are
+    unlinked once it is retired and no render still references them."""
+
+    def __init__(self, brand_id: UUID, model_id: UUID, mask_rgb: np.ndarray, alpha: np.ndarray) -> None:
+        self.segments = []
+        for array in (mask_rgb, alpha):
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[...] = array
+            self.segments.append(shm)
+        self.mask_ref = ("shm", str(brand_id), str(model_id)) + tuple(
+            (shm.name, array.shape) for shm, array in zip(self.segments, (mask_rgb, alpha)))
+        self.source = weakref.ref(mask_rgb)
+        self.nbytes = mask_rgb.nbytes + alpha.nbytes
+        self.users = 0
+        self.retired = False
+
+    def release(self) -> None:
+        for shm in self.segments:
+            shm.close()
+            shm.unlink()
+        self.segments = []
+
+
+class ImagePipeline:
+    """Runs the decode -> resize -> composite -> encode pipeline off the event loop.
+
+    ``IMAGE_PIPELINE_EXECUTOR`` selects a ``process`` pool (default) or a
+    ``thread`` pool and ``IMAGE_PIPELINE_WORKERS`` its size. With a process
+    pool masks are never pickled: compiled masks are memory-mapped by the
+    workers from the MaskStore and S3-fetched masks are published once into
+    shared memory. Published masks are kept in an LRU bounded by
+    ``IMAGE_PIPELINE_SHARED_MASK_MAX_BYTES``, a budget of its own: they are
+    copies of the MaskCache entries, which ``MASK_CACHE_MAX_BYTES`` bounds.
+    A replaced or evicted mask is unlinked once the renders already
+    submitted with it are done.
+    """
+
+    def __init__(self, mask_store: Optional[MaskStore] = None, executor_type: Optional[str] = None,
+                 workers: Optional[int] = None, max_shared_bytes: Optional[int] = None) -> None:
+        self.mask_store = mask_store or MaskStore()
+        self.executor_type = executor_type or os.getenv("IMAGE_PIPELINE_EXECUTOR", "process")
+        self.workers = workers or int(os.getenv("IMAGE_PIPELINE_WORKERS", os.cpu_count() or 1))
+        self._executor: Optional[Executor] = None
+        self.max_shared_bytes = max_shared_bytes if max_shared_bytes is not None else SHARED_MASK_MAX_BYTES
+        self._shared_masks = OrderedDict()
+        self._retired_masks = set()
+        self.shared_bytes = 0
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.executor_type == "thread":
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="image-pipeline")
+                else:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def _acquire_mask(self, brand_id: UUID, model_id: UUID, mask_rgb: np.ndarray,
+                      alpha: np.ndarray) -> tuple:
+        """Returns the mask reference sent to the worker, and the published
+        mask the render holds until ``_release_mask`` (None for store masks)."""
+        if isinstance(mask_rgb, np.memmap):
+            return ("store", str(brand_id), str(model_id), self.mask_store.root,
+                    self.mask_store.version(brand_id, model_id)), None
+        key = (str(brand_id), str(model_id))
+        with self._lock:
+            published = self._shared_masks.get(key)
+            if published is not None and published.source() is mask_rgb:
+                self._shared_masks.move_to_end(key)
+            else:
+                if published is not None:
+                    self._retire(key)
+                published = _SharedMask(brand_id, model_id, mask_rgb, alpha)
+                self._shared_masks[key] = published
+                self.shared_bytes += published.nbytes
+                while self.shared_bytes > self.max_shared_bytes and len(self._shared_masks) > 1:
+                    self._retire(next(iter(self._shared_masks)))
+            published.users += 1
+        return published.mask_ref, published
+
+    def _retire(self, key: tuple) -> None:
+        # Called with the lock held
+        published = self._shared_masks.pop(key)
+        self.shared_bytes -= published.nbytes
+        published.retired = True
+        if published.users:
+            self._retired_masks.add(published)
+        else:
+            published.release()
+
+    def _release_mask(self, published: Optional[_SharedMask]) -> None:
+        if published is None:
+            return
+        with self._lock:
+            published.users -= 1
+            if published.retired and not published.users:
+                self._retired_masks.discard(published)
+                published.release()
+
+    async def render(self, img_bytes: bytes, brand_id: UUID, model_id: UUID,
+                     mask_rgb: np.ndarray, alpha: np.ndarray, output_format: str = "png") -> Optional[bytes]:
+        """Renders the masked image for a generated image on the pipeline executor.
+
+        Args:
+            img_bytes (bytes): Encoded image returned by the generation provider
+            brand_id (UUID): Brand id of the phone model
+            model_id (UUID): Phone model id
+            mask_rgb (np.ndarray): uint8 BGR channels of the mask
+            alpha (np.ndarray): uint8 alpha channel of the mask
+            output_format (str, optional): Preset of scripts.encoders.OUTPUT_FORMATS.
+                Defaults to "png".
+
+        Returns:
+            Optional[bytes]: Encoded image, or None if the image could not be processed
+        """
+        loop = asyncio.get_running_loop()
+        published = None
+        if self.executor_type == "thread":
+            call = (render_case_image, img_bytes, mask_rgb, alpha, output_format)
+        else:
+            mask_ref, published = self._acquire_mask(brand_id, model_id, mask_rgb, alpha)
+            call = (_render_in_worker, img_bytes, mask_ref, output_format)
+        self.submitted += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            result = await loop.run_in_executor(self.executor, *call)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._release_mask(published)
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_type,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "queue_depth": max(self.in_flight - self.workers, 0),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "shared_masks": len(self._shared_masks),
+            "shared_mask_bytes": self.shared_bytes,
+            "retired_masks_in_use": len(self._retired_masks),
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            for published in (*self._shared_masks.values(), *self._retired_masks):
+                published.release()
+            self._shared_masks.clear()
+            self._retired_masks.clear()
+            self.shared_bytes = 0
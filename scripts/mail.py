@@ -0,0 +1,189 @@
+import os
+import asyncio
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Optional
+
+
+def is_permanent(err: Exception) -> bool:
+    """5xx replies (bad recipient, rejected content) are not worth retrying."""
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(err, smtplib.SMTPResponseException) and err.smtp_code >= 500 \
+        and not isinstance(err, smtplib.SMTPAuthenticationError)
+
+
+class MailTemplates:
+    """Jinja2 templates of ``templates/``, parsed and compiled on first use
+    and then served from memory (no stat or read per message)."""
+
+    def __init__(self, directory: str) -> None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+        self.env = Environment(loader=FileSystemLoader(directory), autoescape=select_autoescape(["html"]),
+                               auto_reload=False)
+        self._templates = {}
+
+    def render(self, name: str, **context) -> str:
+        template = self._templates.get(name)
+        if template is None:
+            template = self._templates[name] = self.env.get_template(name)
+        return template.render(**context)
+
+
+class SMTPSender:
+    """Blocking SMTP client keeping one authenticated connection open between
+    batches. Only ever used from the single mail thread of MailQueue.
+
+    ``SMTP_HOST``/``SMTP_PORT`` default to Gmail and ``SMTP_USERNAME`` to
+    ``GMAIL_ID``; ``SMTP_STARTTLS=false`` and an empty ``SMTP_USERNAME``
+    allow a local stand-in such as
+    ``python -m aiosmtpd -n -l localhost:8025``.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None,
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 starttls: Optional[bool] = None, timeout: float = 30.0) -> None:
+        self.host = host or os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.port = port or int(os.getenv("SMTP_PORT", 587))
+        self.username = username if username is not None else os.getenv("SMTP_USERNAME", os.getenv("GMAIL_ID", ""))
+        self.password = password if password is not None else os.getenv("GMAIL_APP_PASS", "")
+        self.starttls = starttls if starttls is not None else \
+            os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+        self.timeout = timeout
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.connects = 0
+
+    def connect(self) -> smtplib.SMTP:
+        self.close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        self.smtp = smtp
+        self.connects += 1
+        return smtp
+
+    def send_batch(self, messages: list) -> list:
+        """Sends messages over the open connection, reconnecting once when
+        the server dropped it (idle timeout) before giving up on a message.
+
+        Returns:
+            list: (message, error) pairs of the messages that were not sent
+        """
+        failed = []
+        for message in messages:
+            for attempt in range(2):
+                try:
+                    (self.smtp or self.connect()).send_message(message)
+                    break
+                except smtplib.SMTPServerDisconnected as err:
+                    self.smtp = None
+                    if attempt:
+                        failed.append((message, err))
+                except smtplib.SMTPException as err:
+                    failed.append((message, err))
+                    break
+                except OSError as err:
+                    self.smtp = None
+                    if attempt:
+                        failed.append((message, err))
+        return failed
+
+    def close(self) -> None:
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+
+class MailQueue:
+    """Outbound mail queue drained by a background task.
+
+    Handlers only enqueue; the drain task sends up to ``MAIL_BATCH_SIZE``
+    queued messages per batch over the persistent SMTP connection on a
+    dedicated thread. Messages that fail are retried with backoff up to
+    ``MAIL_MAX_ATTEMPTS`` times. The queue is in memory: mails still queued
+    when a process is killed are lost, which for reset mails means the user
+    asks again.
+    """
+
+    def __init__(self, sender: Optional[SMTPSender] = None, max_size: Optional[int] = None,
+                 batch_size: Optional[int] = None, max_attempts: Optional[int] = None,
+                 backoff: Optional[float] = None) -> None:
+        self.sender = sender or SMTPSender()
+        self.queue = asyncio.Queue(maxsize=max_size or int(os.getenv("MAIL_QUEUE_MAX_SIZE", 1000)))
+        self.batch_size = batch_size or int(os.getenv("MAIL_BATCH_SIZE", 20))
+        self.max_attempts = max_attempts or int(os.getenv("MAIL_MAX_ATTEMPTS", 3))
+        self.backoff = backoff if backoff is not None else float(os.getenv("MAIL_BACKOFF_SECONDS", 5))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_ms = None
+
+    def submit(self, message: EmailMessage) -> None:
+        """Queues a message and returns immediately.
+
+        Raises:
+            asyncio.QueueFull: The queue is at ``MAIL_QUEUE_MAX_SIZE``
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+        self.queue.put_nowait((message, 1))
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            start = time.perf_counter()
+            try:
+                failed = await loop.run_in_executor(self._executor, self.sender.send_batch,
+                                                    [message for message, _ in batch])
+            except Exception as err:
+                failed = [(message, err) for message, _ in batch]
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            self.batches += 1
+            self.last_batch_ms = round((time.perf_counter() - start) * 1000, 1)
+            attempts = {id(message): attempt for message, attempt in batch}
+            self.sent += len(batch) - len(failed)
+            for message, err in failed:
+                attempt = attempts[id(message)]
+                if attempt >= self.max_attempts or is_permanent(err):
+                    self.failed += 1
+                    print(f"❌ Could not send mail to {message['To']}: {err}")
+                    continue
+                loop.call_later(self.backoff * 2 ** (attempt - 1), self._requeue, message, attempt + 1)
+
+    def _requeue(self, message: EmailMessage, attempt: int) -> None:
+        try:
+            self.queue.put_nowait((message, attempt))
+        except asyncio.QueueFull:
+            self.failed += 1
+            print(f"❌ Mail queue full, dropping mail to {message['To']}")
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Sends what is still queued (up to ``timeout`` seconds), then stops
+        the drain task and closes the SMTP connection."""
+        if self._task is not None and not self._task.done():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"❌ {self.queue.qsize()} mails still queued at shutdown")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.sender.close)
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "sent": self.sent, "failed": self.failed, "batches": self.batches,
+                "last_batch_ms": self.last_batch_ms, "smtp_connects": self.sender.connects}
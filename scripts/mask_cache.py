@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+from uuid import UUID
+
+
+class MaskCache:
+    """Bounded LRU cache of decoded phone masks keyed by (brand_id, model_id).
+
+    Entries are accounted by the ``nbytes`` of the cached arrays and evicted
+    least-recently-used first once ``max_bytes`` is exceeded. After
+    ``revalidate_after`` seconds an entry is checked against the storage
+    ETag and only re-downloaded when the object actually changed.
+    """
+
+    def __init__(self, storage, decoder: Callable, max_bytes: Optional[int] = None,
+                 revalidate_after: Optional[float] = None) -> None:
+        self.storage = storage
+        self.decoder = decoder
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            int(os.getenv("MASK_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+        self.revalidate_after = revalidate_after if revalidate_after is not None else \
+            float(os.getenv("MASK_CACHE_REVALIDATE_SECONDS", 300))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    @staticmethod
+    def mask_key(brand_id: UUID, model_id: UUID) -> str:
+        return f"Masks/{brand_id}/{model_id}"
+
+    @staticmethod
+    def _nbytes(value) -> int:
+        if isinstance(value, (tuple, list)):
+            return sum(getattr(v, "nbytes", 0) for v in value)
+        return getattr(value, "nbytes", 0)
+
+    def get_cached(self, brand_id: UUID, model_id: UUID, etag: Optional[str] = None):
+        """Return the decoded mask if it is cached and does not need
+        revalidation, without doing any I/O. Returns None otherwise. An entry
+        whose ETag equals ``etag`` (known to be current) is always fresh."""
+        with self._lock:
+            entry = self._entries.get((str(brand_id), str(model_id)))
+            if entry and (time.monotonic() - entry[2] < self.revalidate_after or (etag and entry[1] == etag)):
+                self._entries.move_to_end((str(brand_id), str(model_id)))
+                self.hits += 1
+                return entry[0]
+        return None
+
+    def get(self, brand_id: UUID, model_id: UUID):
+        """Return the decoded mask, downloading it from storage only when needed.
+
+        Args:
+            brand_id (UUID): Brand the phone model belongs to.
+            model_id (UUID): Phone model whose mask is requested.
+
+        Returns:
+            The value produced by ``decoder`` for the mask PNG bytes.
+        """
+        key = (str(brand_id), str(model_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+        if entry:
+            value, etag, checked_at = entry
+            if time.monotonic() - checked_at < self.revalidate_after:
+                self.hits += 1
+                return value
+            self.revalidations += 1
+            if self.storage.head_etag(self.mask_key(brand_id, model_id)) == etag:
+                self.hits += 1
+                with self._lock:
+                    if key in self._entries:
+                        self._entries[key] = (value, etag, time.monotonic())
+                return value
+        self.misses += 1
+        body, etag = self.storage.get_object(self.mask_key(brand_id, model_id))
+        value = self.decoder(body)
+        self._store(key, value, etag)
+        return value
+
+    def _store(self, key: tuple, value, etag: Optional[str]) -> None:
+        size = self._nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self.current_bytes -= self._nbytes(previous[0])
+            self._entries[key] = (value, etag, time.monotonic())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.current_bytes -= self._nbytes(evicted)
+                self.evictions += 1
+
+    def invalidate(self, brand_id: UUID, model_id: UUID) -> None:
+        with self._lock:
+            entry = self._entries.pop((str(brand_id), str(model_id)), None)
+            if entry:
+                self.current_bytes -= self._nbytes(entry[0])
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "revalidations": self.revalidations,
+        }
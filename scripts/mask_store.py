@@ -0,0 +1,116 @@
+import os
+from typing import Optional
+from uuid import UUID
+import numpy as np
+
+
+class MaskStore:
+    """Local disk tier of precompiled phone masks.
+
+    Each mask is stored as two raw uint8 ``.npy`` arrays under
+    ``{root}/{brand_id}/{model_id}``: the contiguous BGR channels, ready to
+    be passed to ``composite_masked``, and the alpha channel. Arrays are
+    opened with ``mmap_mode="r"`` so every worker process shares the same
+    pages through the OS page cache instead of holding its own decoded copy.
+    The storage ETag of the source PNG is kept beside them in ``.etag``, so a
+    mask re-uploaded to storage is noticed without recompiling every host.
+    """
+
+    RGB_SUFFIX = ".rgb.npy"
+    ALPHA_SUFFIX = ".alpha.npy"
+    ETAG_SUFFIX = ".etag"
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.root = root or os.getenv("MASK_STORE_DIR", os.path.join(project_dir, "mask_store"))
+
+    @staticmethod
+    def compile(mask: np.ndarray) -> tuple:
+        """Turns a decoded BGRA mask into the arrays used for compositing.
+
+        Args:
+            mask (np.ndarray): Mask decoded with ``cv2.IMREAD_UNCHANGED``
+
+        Returns:
+            tuple: (uint8 BGR channels, uint8 alpha)
+        """
+        mask_rgb = np.ascontiguousarray(mask[:, :, :3])
+        alpha = np.ascontiguousarray(mask[:, :, 3])
+        mask_rgb.setflags(write=False)
+        alpha.setflags(write=False)
+        return mask_rgb, alpha
+
+    def _paths(self, brand_id: UUID, model_id: UUID) -> tuple:
+        base = os.path.join(self.root, str(brand_id), str(model_id))
+        return base + self.RGB_SUFFIX, base + self.ALPHA_SUFFIX
+
+    def _etag_path(self, brand_id: UUID, model_id: UUID) -> str:
+        return os.path.join(self.root, str(brand_id), str(model_id)) + self.ETAG_SUFFIX
+
+    def save(self, brand_id: UUID, model_id: UUID, mask: np.ndarray, etag: Optional[str] = None) -> None:
+        """Compiles a decoded mask and writes it to the store.
+
+        Files are written next to their final path and moved into place, so
+        workers mapping the previous version keep a consistent view. The ETag
+        is written last: a reader racing the write sees the old ETag and
+        treats the mask as a miss.
+
+        Args:
+            brand_id (UUID): Brand id of the phone model
+            model_id (UUID): Phone model id
+            mask (np.ndarray): Mask decoded with ``cv2.IMREAD_UNCHANGED``
+            etag (Optional[str], optional): Storage ETag of the source PNG.
+                Defaults to None (unknown).
+        """
+        rgb_path, alpha_path = self._paths(brand_id, model_id)
+        os.makedirs(os.path.dirname(rgb_path), exist_ok=True)
+        etag_path = self._etag_path(brand_id, model_id)
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+        for path, array in zip((rgb_path, alpha_path), self.compile(mask)):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        if etag:
+            tmp_path = f"{etag_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(etag)
+            os.replace(tmp_path, etag_path)
+
+    def etag(self, brand_id: UUID, model_id: UUID) -> Optional[str]:
+        """Storage ETag the mask was compiled from, None if not recorded."""
+        try:
+            with open(self._etag_path(brand_id, model_id)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def version(self, brand_id: UUID, model_id: UUID) -> Optional[tuple]:
+        """Modification times of a compiled mask's files, changing whenever
+        it is written again. None if not compiled."""
+        try:
+            return tuple(os.stat(path).st_mtime_ns for path in self._paths(brand_id, model_id))
+        except FileNotFoundError:
+            return None
+
+    def load(self, brand_id: UUID, model_id: UUID, etag: Optional[str] = None) -> Optional[tuple]:
+        """Memory-maps a compiled mask.
+
+        Args:
+            brand_id (UUID): Brand id of the phone model
+            model_id (UUID): Phone model id
+            etag (Optional[str], optional): Current storage ETag of the mask.
+                When given, a mask compiled from another (or an unrecorded)
+                ETag is stale and treated as a miss. Defaults to None.
+
+        Returns:
+            Optional[tuple]: (BGR channels, alpha) or None if not compiled or stale
+        """
+        if etag and self.etag(brand_id, model_id) != etag:
+            return None
+        rgb_path, alpha_path = self._paths(brand_id, model_id)
+        try:
+            return (np.load(rgb_path, mmap_mode="r"), np.load(alpha_path, mmap_mode="r"))
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,100 @@
+import os
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+
+
+def build_crypt_context(scheme: Optional[str] = None) -> CryptContext:
+    """CryptContext hashing new passwords with ``PASSWORD_HASH_SCHEME``
+    (``argon2`` by default) and verifying both argon2 and bcrypt hashes.
+    Hashes of the other scheme, or with a lower cost, are reported as
+    needing an update.
+
+    Cost settings: ``PASSWORD_ARGON2_TIME_COST``, ``PASSWORD_ARGON2_MEMORY_KIB``,
+    ``PASSWORD_ARGON2_PARALLELISM`` and ``PASSWORD_BCRYPT_ROUNDS``.
+    """
+    scheme = scheme or os.getenv("PASSWORD_HASH_SCHEME", "argon2")
+    schemes = ["argon2", "bcrypt"] if scheme == "argon2" else ["bcrypt", "argon2"]
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",
+        argon2__time_cost=int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2)),
+        argon2__memory_cost=int(os.getenv("PASSWORD_ARGON2_MEMORY_KIB", 19456)),
+        argon2__parallelism=int(os.getenv("PASSWORD_ARGON2_PARALLELISM", 1)),
+        bcrypt__rounds=int(os.getenv("PASSWORD_BCRYPT_ROUNDS", 12)),
+    )
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a small thread pool so the event loop
+    never runs a 100+ ms hash. argon2-cffi and bcrypt release the GIL, so the
+    threads hash in parallel.
+
+    At most ``PASSWORD_HASH_WORKERS`` hashes run at once; further requests wait
+    on the loop instead of piling up in the executor queue, so a burst of
+    logins cannot pin every core of the host.
+    """
+
+    def __init__(self, context: Optional[CryptContext] = None, workers: Optional[int] = None) -> None:
+        self.context = context or build_crypt_context()
+        self.workers = workers or int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._slots = asyncio.Semaphore(self.workers)
+        self.hashes = 0
+        self.rehashes = 0
+        self.hash_seconds_total = 0.0
+        self.waiting = 0
+
+    async def _run(self, fn, *args):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+            self.hashes += 1
+            self.hash_seconds_total += time.perf_counter() - start
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """Verifies a password and, when the stored hash uses a deprecated
+        scheme or cost, returns its replacement.
+
+        Args:
+            password (str): Plain password sent by the user
+            hashed (Optional[str]): Stored hash, None for OAuth accounts
+
+        Returns:
+            Tuple[bool, Optional[str]]: Whether the password matches, and the
+                new hash to store or None
+        """
+        if not hashed:
+            return False, None
+        try:
+            valid, new_hash = await self._run(self.context.verify_and_update, password, hashed)
+        except ValueError:
+            # Unknown or malformed hash
+            return False, None
+        self.rehashes += new_hash is not None
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "scheme": self.context.default_scheme(),
+            "workers": self.workers,
+            "waiting": self.waiting,
+            "hashes": self.hashes,
+            "hash_ms_avg": round(self.hash_seconds_total / self.hashes * 1000, 1) if self.hashes else None,
+            "rehashes": self.rehashes,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Optional
+from redis.asyncio import Redis
+
+PROMPT_CACHE_PREFIX = "prompt_cache"
+PROMPT_CACHE_LRU = "prompt_cache:lru"
+PROMPT_CACHE_META = "prompt_cache:meta"
+PROMPT_CACHE_BYTES = "prompt_cache:bytes"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Folds case, whitespace and trailing punctuation so near-identical
+    prompts share a cache entry."""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip(".!,;: ").casefold()
+
+
+class CachedOutput:
+    """Stand-in for a provider output: exposes the ``url`` and ``aread`` that
+    ``Utils.handle_generation`` uses."""
+
+    def __init__(self, url: Optional[str], data: Optional[bytes] = None,
+                 loader: Optional[Callable[[], Awaitable[bytes]]] = None) -> None:
+        self.url = url
+        self._data = data
+        self._loader = loader
+
+    async def aread(self) -> bytes:
+        if self._data is None:
+            self._data = await self._loader()  # type: ignore
+        return self._data
+
+
+class PromptCache:
+    """Caches raw generated images by normalized prompt, model, aspect ratio
+    and number of outputs.
+
+    Images are stored in the configured Storage backend (S3 or local disk)
+    under ``PromptCache/<digest>/`` and indexed in Redis. Entries expire
+    ``PROMPT_CACHE_TTL_SECONDS`` after their last hit and are evicted least
+    recently used first once the stored images exceed
+    ``PROMPT_CACHE_MAX_BYTES``. Concurrent misses for the same key within a
+    process share one provider call.
+    """
+
+    def __init__(self, storage, ttl: Optional[int] = None, max_bytes: Optional[int] = None,
+                 link_expires: int = 3600) -> None:
+        self.storage = storage
+        self.ttl = ttl if ttl is not None else int(os.getenv("PROMPT_CACHE_TTL_SECONDS", 7 * 86400))
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            int(os.getenv("PROMPT_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+        self.link_expires = link_expires
+        self._inflight = {}
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def cache_key(prompt: str, model: str, aspect_ratio: str, num_outputs: int) -> str:
+        raw = "\x1f".join((normalize_prompt(prompt), model, aspect_ratio, str(num_outputs)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def entry_key(digest: str) -> str:
+        return f"{PROMPT_CACHE_PREFIX}:{digest}"
+
+    async def get(self, r: Redis, digest: str) -> Optional[list]:
+        """Returns the cached outputs for ``digest`` or None on a miss."""
+        entry = await r.get(self.entry_key(digest))
+        if not entry:
+            return None
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.expire(self.entry_key(digest), self.ttl)
+            pipe.zadd(PROMPT_CACHE_LRU, {digest: time.time()})
+            await pipe.execute()
+        object_keys = json.loads(entry)
+        urls = await asyncio.gather(*(self.storage.presign(key, key.rsplit("/", 1)[-1], "image/png",
+                                                           self.link_expires)
+                                      for key in object_keys))
+        return [CachedOutput(url, loader=lambda key=key: self._load(key)) for key, url in zip(object_keys, urls)]
+
+    async def _load(self, key: str) -> bytes:
+        data, _ = await self.storage.get(key)
+        return data
+
+    async def put(self, r: Redis, digest: str, images: list) -> None:
+        object_keys = [f"PromptCache/{digest}/{i}.png" for i in range(len(images))]
+        await asyncio.gather(*(self.storage.run(self.storage.put_object, key, data, "image/png")
+                               for key, data in zip(object_keys, images)))
+        size = sum(len(data) for data in images)
+        if not await r.set(self.entry_key(digest), json.dumps(object_keys), ex=self.ttl, nx=True):
+            # Another process cached the same prompt first
+            return
+        stale = await r.hget(PROMPT_CACHE_META, digest)
+        async with r.pipeline(transaction=True) as pipe:
+            if stale:
+                # Expired entry not swept yet, its objects were just overwritten
+                pipe.decrby(PROMPT_CACHE_BYTES, json.loads(stale)["bytes"])
+            pipe.zadd(PROMPT_CACHE_LRU, {digest: time.time()})
+            pipe.hset(PROMPT_CACHE_META, digest, json.dumps({"bytes": size, "objects": object_keys}))
+            pipe.incrby(PROMPT_CACHE_BYTES, size)
+            await pipe.execute()
+        await self.evict(r)
+
+    async def evict(self, r: Redis) -> None:
+        """Removes entries idle for longer than the TTL, then the least recently
+        used ones while the cache is over its byte budget. ZPOPMIN hands every
+        digest to exactly one evicting process."""
+        expired = await r.zrangebyscore(PROMPT_CACHE_LRU, 0, time.time() - self.ttl)
+        for digest in expired:
+            if await r.zrem(PROMPT_CACHE_LRU, digest):
+                await self._remove(r, digest)
+        while int(await r.get(PROMPT_CACHE_BYTES) or 0) > self.max_bytes:
+            popped = await r.zpopmin(PROMPT_CACHE_LRU)
+            if not popped:
+                break
+            await self._remove(r, popped[0][0])
+
+    async def _remove(self, r: Redis, digest: str) -> None:
+        meta = await r.hget(PROMPT_CACHE_META, digest)
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.delete(self.entry_key(digest))
+            pipe.hdel(PROMPT_CACHE_META, digest)
+            if meta:
+                pipe.decrby(PROMPT_CACHE_BYTES, json.loads(meta)["bytes"])
+            await pipe.execute()
+        if meta:
+            await asyncio.gather(*(self.storage.run(self.storage.delete_object, key)
+                                   for key in json.loads(meta)["objects"]), return_exceptions=True)
+        self.evictions += 1
+
+    async def get_or_generate(self, r: Redis, digest: str, generate: Callable[[], Awaitable[list]]) -> list:
+        """Returns cached outputs, or calls ``generate`` once for all concurrent
+        callers asking for the same digest and caches its result.
+
+        Args:
+            r (Redis): Shared async Redis client
+            digest (str): Key built by ``cache_key``
+            generate (Callable[[], Awaitable[list]]): Provider call returning
+                outputs with ``url`` and ``aread``
+
+        Returns:
+            list: Outputs with ``url`` and ``aread``, empty if generation failed
+        """
+        inflight = self._inflight.get(digest)
+        if inflight is None:
+            cached = await self.get(r, digest)
+            if cached:
+                self.hits += 1
+                return cached
+            inflight = self._inflight.get(digest)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+        self.misses += 1
+        task = asyncio.create_task(self._generate(r, digest, generate))
+        self._inflight[digest] = task
+        task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        return await asyncio.shield(task)
+
+    async def _generate(self, r: Redis, digest: str, generate: Callable[[], Awaitable[list]]) -> list:
+        outputs = await generate()
+        if not outputs:
+            return []
+        images = await asyncio.gather(*(out.aread() for out in outputs))
+        store = asyncio.create_task(self._store(r, digest, images))
+        self._tasks.add(store)
+        store.add_done_callback(self._tasks.discard)
+        return [CachedOutput(out.url, data=data) for out, data in zip(outputs, images)]
+
+    async def _store(self, r: Redis, digest: str, images: list) -> None:
+        try:
+            await self.put(r, digest, images)
+        except Exception as err:
+            print(f"Could not cache generated images for {digest}: {err}")
+
+    async def stats(self, r: Redis) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "entries": await r.zcard(PROMPT_CACHE_LRU),
+            "bytes": int(await r.get(PROMPT_CACHE_BYTES) or 0),
+            "max_bytes": self.max_bytes,
+        }
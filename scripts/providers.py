@@ -0,0 +1,308 @@
+import os
+import io
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Optional
+
+
+class GeneratedImage:
+    """Provider independent generation result.
+
+    ``data`` is always PNG bytes. ``url`` is set when the provider hosts the
+    image (Replicate) and None otherwise; ``aread`` mirrors the Replicate
+    FileOutput interface the rest of the pipeline uses.
+    """
+
+    def __init__(self, data: bytes, url: Optional[str] = None) -> None:
+        self.data = data
+        self.url = url
+
+    async def aread(self) -> bytes:
+        return self.data
+
+
+class ReplicateProvider:
+    name = "replicate"
+
+    def __init__(self, model: str = "black-forest-labs/flux-schnell") -> None:
+        self.model = model
+
+    async def generate(self, prompt: str, width: int, height: int, aspect_ratio: str,
+                       num_outputs: int) -> list:
+        import replicate
+        outputs = await replicate.async_run(self.model, input={
+            "prompt": prompt,
+            "aspect_ratio": aspect_ratio,
+            "output_format": "png",
+            "num_outputs": num_outputs
+        })
+        images = await asyncio.gather(*(out.aread() for out in outputs))  # type: ignore
+        return [GeneratedImage(data, str(out.url)) for out, data in zip(outputs, images)]  # type: ignore
+
+
+class HFProvider:
+    """FLUX.1-schnell through the Hugging Face inference client (Together).
+    The client returns one PIL image per call, so outputs are requested
+    concurrently and encoded to PNG off the event loop."""
+    name = "hf"
+
+    def __init__(self, client, model: str = "black-forest-labs/FLUX.1-schnell") -> None:
+        self.client = client
+        self.model = model
+
+    def _generate_png(self, prompt: str, width: int, height: int) -> bytes:
+        image = self.client.text_to_image(prompt=prompt, model=self.model, height=height, width=width)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    async def generate(self, prompt: str, width: int, height: int, aspect_ratio: str,
+                       num_outputs: int) -> list:
+        images = await asyncio.gather(*(asyncio.to_thread(self._generate_png, prompt, width, height)
+                                        for _ in range(num_outputs)))
+        return [GeneratedImage(data) for data in images]
+
+
+class FakeProvider:
+    """Offline provider returning solid-colour PNGs after a random latency,
+    failing with probability ``error_rate``. Used by the router benchmark
+    and for local runs (``GENERATION_PROVIDERS=fake``)."""
+
+    def __init__(self, name: str = "fake", latency: float = 0.5, jitter: float = 0.2,
+                 error_rate: float = 0.0, seed: Optional[int] = None) -> None:
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    async def generate(self, prompt: str, width: int, height: int, aspect_ratio: str,
+                       num_outputs: int) -> list:
+        import cv2
+        import numpy as np
+        self.calls += 1
+        await asyncio.sleep(max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0))
+        if self.rng.random() < self.error_rate:
+            raise RuntimeError(f"{self.name} failed")
+        images = []
+        for _ in range(num_outputs):
+            colour = [self.rng.randrange(256) for _ in range(3)]
+            success, encoded = cv2.imencode(".png", np.full((height, width, 3), colour, np.uint8))
+            images.append(GeneratedImage(encoded.tobytes()))
+        return images
+
+
+class ProviderHealth:
+    """Rolling latency and error window of one provider plus its circuit breaker.
+
+    The breaker opens after ``failure_threshold`` consecutive failures and
+    stays open for ``cooldown`` seconds; after that a single trial request is
+    let through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, cooldown: float = 30.0) -> None:
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.trips = 0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.trial_in_flight = False
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.trips += self.opened_at is None
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "error_rate": round(self.error_rate, 3),
+            "samples": len(self.outcomes),
+            "trips": self.trips,
+        }
+
+
+class ProviderRouter:
+    """Sends each generation to the fastest healthy provider and hedges to
+    the next one when it is slow.
+
+    Providers are ranked by rolling p50 latency (providers without samples
+    first, so every provider gets measured) and skipped while their circuit
+    breaker is open. If the primary has not answered after the hedge delay a
+    second request goes to the next provider and the first usable result
+    wins; the loser is cancelled. A failing provider fails over immediately.
+    The hedge delay is ``PROVIDER_HEDGE_AFTER_SECONDS`` if set, otherwise the
+    lowest rolling p95 of the providers.
+    """
+
+    def __init__(self, providers: list, hedge_after: Optional[float] = None,
+                 default_hedge_after: float = 10.0, failure_threshold: Optional[int] = None,
+                 cooldown: Optional[float] = None, probe_every: Optional[int] = None) -> None:
+        self.providers = {provider.name: provider for provider in providers}
+        env_hedge_after = os.getenv("PROVIDER_HEDGE_AFTER_SECONDS")
+        self.hedge_after = hedge_after if hedge_after is not None else \
+            (float(env_hedge_after) if env_hedge_after else None)
+        self.default_hedge_after = default_hedge_after
+        failure_threshold = failure_threshold or int(os.getenv("PROVIDER_FAILURE_THRESHOLD", 3))
+        cooldown = cooldown if cooldown is not None else float(os.getenv("PROVIDER_COOLDOWN_SECONDS", 30))
+        self.health = {name: ProviderHealth(failure_threshold=failure_threshold, cooldown=cooldown)
+                       for name in self.providers}
+        self.probe_every = probe_every or int(os.getenv("PROVIDER_PROBE_EVERY", 20))
+        self.requests = 0
+        self.last_called = {name: 0 for name in self.providers}
+        self.hedges = 0
+        self.secondary_wins = 0
+
+    def ranked(self) -> list:
+        """Providers to try in order. A provider that has not been called for
+        ``probe_every`` requests goes first once, so a provider that had a
+        bad spell gets re-measured instead of being starved."""
+        def key(name):
+            p50 = self.health[name].percentile(0.5)
+            return (p50 is not None, p50 or 0.0, self.health[name].error_rate)
+        order = sorted((name for name in self.providers if self.health[name].state != "open"), key=key)
+        stale = [name for name in order[1:] if self.requests - self.last_called[name] >= self.probe_every]
+        if stale:
+            order.remove(stale[0])
+            order.insert(0, stale[0])
+        return order
+
+    def hedge_delay(self) -> float:
+        """``hedge_after`` if configured, otherwise the lowest rolling p95, so a
+        probe of a slow provider is hedged as early as a normal request."""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        p95s = [p95 for p95 in (health.percentile(0.95) for health in self.health.values()) if p95 is not None]
+        return min(p95s) if p95s else self.default_hedge_after
+
+    async def _call(self, name: str, *args) -> list:
+        start = time.monotonic()
+        try:
+            images = await self.providers[name].generate(*args)
+        except asyncio.CancelledError:
+            self.health[name].trial_in_flight = False
+            raise
+        except Exception as err:
+            self.health[name].record(time.monotonic() - start, False)
+            print(f"Provider {name} failed: {err}")
+            raise
+        if not images:
+            self.health[name].record(time.monotonic() - start, False)
+            raise RuntimeError(f"Provider {name} returned no images")
+        self.health[name].record(time.monotonic() - start, True)
+        return images
+
+    async def generate(self, prompt: str, width: int, height: int, aspect_ratio: str,
+                       num_outputs: int) -> list:
+        """Generates ``num_outputs`` PNGs through the providers.
+
+        Args:
+            prompt (str): User prompt
+            width (int): Image width in pixels
+            height (int): Image height in pixels
+            aspect_ratio (str): Closest supported aspect ratio, e.g. "9:16"
+            num_outputs (int): Number of images to generate
+
+        Returns:
+            list: GeneratedImage objects, empty if every provider failed
+        """
+        self.requests += 1
+        candidates = self.ranked()
+        hedge_delay = self.hedge_delay()
+        args = (prompt, width, height, aspect_ratio, num_outputs)
+        primary = None
+        running = {}
+        try:
+            while candidates or running:
+                if len(running) < 2:
+                    # allow() is only asked when a provider is about to be
+                    # called, so a half-open trial slot is never wasted
+                    while candidates and not self.health[candidates[0]].allow():
+                        candidates.pop(0)
+                    if candidates:
+                        name = candidates.pop(0)
+                        primary = primary or name
+                        if running:
+                            self.hedges += 1
+                        self.last_called[name] = self.requests
+                        running[asyncio.create_task(self._call(name, *args))] = name
+                if not running:
+                    break
+                timeout = hedge_delay if candidates and len(running) < 2 else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    if task.exception() is None:
+                        if name != primary:
+                            self.secondary_wins += 1
+                        return task.result()
+        finally:
+            for task in running:
+                task.cancel()
+        return []
+
+    def stats(self) -> dict:
+        return {
+            "providers": {name: health.stats() for name, health in self.health.items()},
+            "hedges": self.hedges,
+            "secondary_wins": self.secondary_wins,
+        }
+
+
+def build_providers(utils) -> list:
+    """Builds the providers listed in ``GENERATION_PROVIDERS`` (comma separated
+    ``replicate``, ``hf``, ``fake``). ``hf`` is only included by default when
+    ``HF_TOKEN`` is set."""
+    default = "replicate,hf" if os.getenv("HF_TOKEN") else "replicate"
+    providers = []
+    for name in os.getenv("GENERATION_PROVIDERS", default).split(","):
+        name = name.strip()
+        if name == "replicate":
+            providers.append(ReplicateProvider())
+        elif name == "hf":
+            providers.append(HFProvider(utils.client))
+        elif name.startswith("fake"):
+            providers.append(FakeProvider(name))
+    return providers
@@ -0,0 +1,115 @@
+import os
+import math
+from typing import NamedTuple, Optional
+from uuid import uuid4
+from redis.asyncio import Redis
+
+# One round trip per check. The fixed window is a counter expiring with the
+# window; the sliding window is a log of admission times (milliseconds from
+# the Redis clock, so API hosts agree) trimmed to the window. Refused
+# requests are not counted. Returns {allowed, remaining, retry_after_ms}.
+RATE_LIMIT_SCRIPT = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+if ARGV[3] == 'sliding' then
+    local now = redis.call('TIME')
+    local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now_ms - window_ms)
+    local count = redis.call('ZCARD', key)
+    if count >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        return {0, 0, tonumber(oldest[2]) + window_ms - now_ms}
+    end
+    redis.call('ZADD', key, now_ms, ARGV[4])
+    redis.call('PEXPIRE', key, window_ms)
+    return {1, limit - count - 1, 0}
+end
+local count = tonumber(redis.call('GET', key) or '0')
+if count >= limit then
+    return {0, 0, redis.call('PTTL', key)}
+end
+count = redis.call('INCR', key)
+if count == 1 then
+    redis.call('PEXPIRE', key, window_ms)
+end
+return {1, limit - count, 0}
+"""
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class RateLimit(NamedTuple):
+    limit: int
+    window: int
+    algorithm: str = "fixed"
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["RateLimit"]:
+        """Parses ``<limit>/<window>[:fixed|sliding]``, the window in seconds
+        or with an s/m/h/d suffix, e.g. ``1/30d`` or ``30/1h:sliding``.
+        An empty spec or a limit of 0 disables the limit."""
+        spec = spec.strip()
+        if not spec:
+            return None
+        quota, _, algorithm = spec.partition(":")
+        limit, _, window = quota.partition("/")
+        algorithm = algorithm or "fixed"
+        if algorithm not in ("fixed", "sliding"):
+            raise ValueError(f"Unknown rate limit algorithm {algorithm}")
+        window = window.strip()
+        seconds = int(window[:-1]) * WINDOW_UNITS[window[-1]] if window[-1:] in WINDOW_UNITS else int(window)
+        if int(limit) <= 0:
+            return None
+        return cls(int(limit), seconds, algorithm)
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: Optional[int]
+    retry_after: int
+
+
+class RateLimiter:
+    """Generation quotas per tier, checked atomically by a Lua script.
+
+    ``RATE_LIMIT_ANON`` applies to the ``anon_id`` cookie and defaults to one
+    generation per 30 days, the quota anonymous users always had.
+    ``RATE_LIMIT_USER`` applies to the ``public_id`` of logged in users.
+    See ``RateLimit.parse`` for the format.
+    """
+
+    def __init__(self, limits: Optional[dict] = None) -> None:
+        self.limits = limits if limits is not None else {
+            "anon": RateLimit.parse(os.getenv("RATE_LIMIT_ANON", "1/30d:fixed")),
+            "user": RateLimit.parse(os.getenv("RATE_LIMIT_USER", "30/1h:sliding")),
+        }
+        self._script = None
+
+    @staticmethod
+    def key(tier: str, identity: str) -> str:
+        return f"rate_limit:{tier}:{identity}"
+
+    async def hit(self, r: Redis, tier: str, identity: str) -> RateLimitResult:
+        """Counts one request of ``identity`` against the quota of ``tier``.
+
+        Args:
+            r (Redis): Shared async Redis client
+            tier (str): ``anon`` or ``user``
+            identity (str): anon_id cookie or user public_id
+
+        Returns:
+            RateLimitResult: Whether the request is allowed, the requests left
+                in the window and, when refused, the seconds until retrying
+        """
+        rate_limit = self.limits.get(tier)
+        if rate_limit is None:
+            return RateLimitResult(True, None, 0)
+        if self._script is None:
+            self._script = r.register_script(RATE_LIMIT_SCRIPT)
+        allowed, remaining, retry_after_ms = await self._script(
+            keys=[self.key(tier, identity)],
+            args=[rate_limit.limit, rate_limit.window * 1000, rate_limit.algorithm, uuid4().hex],
+            client=r)
+        return RateLimitResult(bool(allowed), int(remaining), max(math.ceil(int(retry_after_ms) / 1000), 1)
+                               if not allowed else 0)
@@ -0,0 +1,118 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+from uuid import UUID
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models import PhoneModel
+
+RENDER_DPI = 300
+# Aspect ratios accepted by flux-schnell, kept in the order of Utils.closest_aspect_ratio
+ASPECT_RATIOS = {
+    "1:1": 1 / 1,
+    "16:9": 16 / 9,
+    "21:9": 21 / 9,
+    "3:2": 3 / 2,
+    "2:3": 2 / 3,
+    "4:5": 4 / 5,
+    "5:4": 5 / 4,
+    "3:4": 3 / 4,
+    "4:3": 4 / 3,
+    "9:16": 9 / 16,
+    "9:21": 9 / 21
+}
+
+
+class RenderProfile(NamedTuple):
+    """Everything the generation hot path needs to know about a phone model."""
+    model_id: UUID
+    brand_id: UUID
+    pixel_width: int
+    pixel_height: int
+    aspect_ratio: str
+    mask_key: str
+    mask_etag: Optional[str]
+
+
+def mask_key(brand_id, model_id) -> str:
+    return f"Masks/{brand_id}/{model_id}"
+
+
+def compute_pixels_and_ratios(widths_mm, heights_mm, dpi: int = RENDER_DPI) -> tuple:
+    """Vectorized ``Utils.mm_to_pixels`` and ``Utils.closest_aspect_ratio``.
+
+    Args:
+        widths_mm: Phone widths in mm
+        heights_mm: Phone heights in mm
+        dpi (int, optional): Render resolution. Defaults to 300.
+
+    Returns:
+        tuple: (pixel widths, pixel heights, aspect ratio names) as lists
+    """
+    import numpy as np
+    mm = np.array([widths_mm, heights_mm], dtype=np.float64).reshape(2, -1)
+    # np.round rounds half to even like the builtin round used by mm_to_pixels
+    pixels = np.round(mm / 25.4 * dpi).astype(np.int64)
+    pixels = -(-pixels // 16) * 16
+    names = list(ASPECT_RATIOS)
+    ratios = np.array([ASPECT_RATIOS[name] for name in names])
+    closest = np.abs(ratios[None, :] - (pixels[0] / pixels[1])[:, None]).argmin(axis=1)
+    return pixels[0].tolist(), pixels[1].tolist(), [names[i] for i in closest]
+
+
+def refresh_render_profiles(session: Session, head_etag=None, workers: int = 16) -> int:
+    """Recomputes and stores the render profile of every phone model.
+
+    Run by the seed and mask upload scripts; ``AsyncSession.run_sync`` can
+    pass it a session from async code.
+
+    Args:
+        session (Session): Sync session, committed by the caller
+        head_etag (optional): ``Storage.head_etag``-like callable used to
+            record the mask ETag of models with a mask. Defaults to None,
+            which keeps the stored ETags.
+        workers (int, optional): Concurrent HEAD requests. Defaults to 16.
+
+    Returns:
+        int: Number of models updated
+    """
+    rows = session.execute(
+        select(PhoneModel.id, PhoneModel.brand_id, PhoneModel.phone_width, PhoneModel.phone_height,
+               PhoneModel.mask_available)
+        .where(PhoneModel.phone_width.is_not(None), PhoneModel.phone_height.is_not(None))
+    ).all()
+    if not rows:
+        return 0
+    widths, heights, ratios = compute_pixels_and_ratios([row.phone_width for row in rows],
+                                                        [row.phone_height for row in rows])
+    keys = [mask_key(row.brand_id, row.id) for row in rows]
+    values = [{"id": row.id, "pixel_width": width, "pixel_height": height, "aspect_ratio": ratio, "mask_key": key}
+              for row, width, height, ratio, key in zip(rows, widths, heights, ratios, keys)]
+    if head_etag is not None:
+        etags = [None] * len(rows)
+        masked = [i for i, row in enumerate(rows) if row.mask_available]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, etag in zip(masked, pool.map(head_etag, [keys[i] for i in masked])):
+                etags[i] = etag
+        for value, etag in zip(values, etags):
+            value["mask_etag"] = etag
+    session.execute(update(PhoneModel), values)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from scripts.catalog import bump_catalog_version
+    from scripts.storage import get_storage
+    load_dotenv()
+    DATABASE_URL = os.getenv("EC2_SYNC_DATABASE_URL")
+    assert DATABASE_URL is not None, "Database url missing"
+    storage = get_storage()
+    with Session(create_engine(DATABASE_URL)) as session:
+        updated = refresh_render_profiles(session, storage.head_etag)
+        session.commit()
+    storage.shutdown()
+    print(f"✅ Render profiles refreshed for {updated} phone models")
+    bump_catalog_version()
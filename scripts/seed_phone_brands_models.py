@@ -10,6 +10,8 @@ load_dotenv()
 
 from app.db import SessionLocal
 from app.models import PhoneBrand, PhoneModel
+from scripts.catalog import bump_catalog_version
+from scripts.render_profiles import refresh_render_profiles
 
 
 async def seed_from_csv(csv_path):
@@ -43,8 +45,11 @@ async def seed_from_csv(csv_path):
                     )
                     session.add(model)
 
+        await session.flush()
+        await session.run_sync(refresh_render_profiles)
         await session.commit()
         print("✅ CSV seed completed.")
+    bump_catalog_version()
 
 
 async def seed_from_json_metadata(json_path):
@@ -79,8 +84,11 @@ async def seed_from_json_metadata(json_path):
                 phone_height=model_height,
             )
             session.add(model)       
+        await session.flush()
+        await session.run_sync(refresh_render_profiles)
         await session.commit()
         print("✅ JSON seed completed.")
+    bump_catalog_version()
 
             
 
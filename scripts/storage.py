@@ -0,0 +1,302 @@
+import os
+import io
+import shutil
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterable, Optional
+import boto3
+from botocore.client import Config
+from botocore.exceptions import ClientError
+
+
+class Storage(ABC):
+    """Object storage used for masks and generated images.
+
+    Backends implement the abstract blocking primitives (``put_object``,
+    ``get_object``, ``head_etag``, ``delete_object``, ``presigned_url`` and
+    the multipart ones); the async methods run them on a dedicated, bounded
+    thread pool so request handlers never block the event loop on storage I/O.
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or int(os.getenv("STORAGE_WORKERS", 16))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="storage")
+        # S3 parts must be at least 5 MiB, except the last one
+        self.part_size = max(int(float(os.getenv("STORAGE_PART_SIZE_MB", 8)) * 1024 * 1024), 5 * 1024 * 1024)
+        self.upload_concurrency = int(os.getenv("STORAGE_UPLOAD_CONCURRENCY", 4))
+
+    @abstractmethod
+    def put_object(self, key: str, data: bytes, content_type: str) -> None:
+        ...
+
+    @abstractmethod
+    def get_object(self, key: str) -> tuple:
+        """Returns (body bytes, etag) for ``key``."""
+
+    @abstractmethod
+    def head_etag(self, key: str) -> Optional[str]:
+        """Returns the current ETag of ``key`` or None if it does not exist."""
+
+    @abstractmethod
+    def delete_object(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def presigned_url(self, key: str, filename: str, content_type: str, expires: int) -> str:
+        ...
+
+    @abstractmethod
+    def create_multipart(self, key: str, content_type: str) -> str:
+        """Starts a multipart upload and returns its id."""
+
+    @abstractmethod
+    def upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> dict:
+        """Uploads part ``number`` (1-based) and returns what
+        ``complete_multipart`` needs to reference it."""
+
+    @abstractmethod
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> None:
+        ...
+
+    @abstractmethod
+    def abort_multipart(self, key: str, upload_id: str) -> None:
+        ...
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _upload_and_presign(self, key: str, data: bytes, content_type: str, expires: int) -> str:
+        extension = content_type.split("/")[-1]
+        self.put_object(key, data, content_type)
+        return self.presigned_url(key, f"{key}.{extension}", content_type, expires)
+
+    async def upload(self, key: str, data: bytes, content_type: str = "image/png", expires: int = 86400) -> str:
+        """Uploads ``data`` and returns a download link valid for ``expires`` seconds.
+
+        Args:
+            key (str): Object key
+            data (bytes): Object body
+            content_type (str, optional): Content type. Defaults to "image/png".
+            expires (int, optional): Link lifetime in seconds. Defaults to 86400.
+
+        Returns:
+            str: Download link
+        """
+        return await self.run(self._upload_and_presign, key, data, content_type, expires)
+
+    async def upload_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str = "image/png",
+                            expires: int = 86400) -> str:
+        """Uploads an object from a stream of chunks as a multipart upload and
+        returns a download link, without holding the whole object in memory.
+
+        Chunks are cut into ``STORAGE_PART_SIZE_MB`` parts, of which at most
+        ``STORAGE_UPLOAD_CONCURRENCY`` are uploaded at once; reading the
+        stream pauses while every slot is busy. Memory per upload is thus
+        bounded by about ``(concurrency + 1) * part size``. Objects smaller
+        than one part are sent with a single ``put_object``.
+
+        Args:
+            key (str): Object key
+            chunks (AsyncIterable[bytes]): Object body
+            content_type (str, optional): Content type. Defaults to "image/png".
+            expires (int, optional): Link lifetime in seconds. Defaults to 86400.
+
+        Returns:
+            str: Download link
+        """
+        slots = asyncio.Semaphore(self.upload_concurrency)
+        uploads = []
+        upload_id = None
+        pending, pending_size = [], 0
+
+        async def send_part(number: int, data: bytes) -> dict:
+            try:
+                return await self.run(self.upload_part, key, upload_id, number, data)
+            finally:
+                slots.release()
+
+        async def flush(data: bytes) -> None:
+            nonlocal upload_id
+            if upload_id is None:
+                upload_id = await self.run(self.create_multipart, key, content_type)
+            await slots.acquire()
+            uploads.append(asyncio.create_task(send_part(len(uploads) + 1, data)))
+
+        try:
+            async for chunk in chunks:
+                pending.append(chunk)
+                pending_size += len(chunk)
+                while pending_size >= self.part_size:
+                    # Only the chunk crossing the part boundary is split
+                    overflow = pending_size - self.part_size
+                    last = pending[-1]
+                    if overflow:
+                        pending[-1] = last[:len(last) - overflow]
+                    data = b"".join(pending)
+                    pending = [last[len(last) - overflow:]] if overflow else []
+                    pending_size = overflow
+                    await flush(data)
+            if upload_id is None:
+                return await self.upload(key, b"".join(pending), content_type, expires)
+            if pending_size:
+                await flush(b"".join(pending))
+            pending = []
+            parts = await asyncio.gather(*uploads)
+            await self.run(self.complete_multipart, key, upload_id, parts)
+        except BaseException:
+            for task in uploads:
+                task.cancel()
+            await asyncio.gather(*uploads, return_exceptions=True)
+            if upload_id is not None:
+                await self.run(self.abort_multipart, key, upload_id)
+            raise
+        extension = content_type.split("/")[-1]
+        return await self.presign(key, f"{key}.{extension}", content_type, expires)
+
+    async def get(self, key: str) -> tuple:
+        return await self.run(self.get_object, key)
+
+    async def presign(self, key: str, filename: str, content_type: str = "image/png", expires: int = 86400) -> str:
+        return await self.run(self.presigned_url, key, filename, content_type, expires)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class S3Storage(Storage):
+
+    def __init__(self, bucket: Optional[str] = None, workers: Optional[int] = None) -> None:
+        super().__init__(workers)
+        self.bucket = bucket or os.getenv("AWS_S3_BUCKET")
+        self.s3 = boto3.client(
+            "s3",
+            region_name=os.getenv("AWS_REGION"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            config=Config(signature_version="s3v4",
+                          max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", self.workers)))
+        )
+
+    def put_object(self, key: str, data: bytes, content_type: str) -> None:
+        self.s3.upload_fileobj(
+            Fileobj=io.BytesIO(data),
+            Bucket=self.bucket,
+            Key=key,
+            ExtraArgs={'ContentType': content_type}
+        )
+
+    def get_object(self, key: str) -> tuple:
+        response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        return response.get("Body").read(), response.get("ETag")
+
+    def head_etag(self, key: str) -> Optional[str]:
+        try:
+            response = self.s3.head_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return None
+        return response.get("ETag")
+
+    def delete_object(self, key: str) -> None:
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+    def presigned_url(self, key: str, filename: str, content_type: str, expires: int) -> str:
+        return self.s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket,
+                    "ResponseContentDisposition": f"attachment; filename={filename}",
+                    "Key": key,
+                    "ResponseContentType": content_type},
+            ExpiresIn=expires
+        )
+
+    def create_multipart(self, key: str, content_type: str) -> str:
+        response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=key, ContentType=content_type)
+        return response["UploadId"]
+
+    def upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> dict:
+        response = self.s3.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data)
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> None:
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                          MultipartUpload={"Parts": parts})
+
+    def abort_multipart(self, key: str, upload_id: str) -> None:
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+
+class LocalStorage(Storage):
+    """Filesystem backend for running the service and benchmarks offline.
+
+    Objects live under ``LOCAL_STORAGE_DIR`` and links are built from
+    ``LOCAL_STORAGE_URL`` (a ``file://`` URI by default).
+    """
+
+    def __init__(self, root: Optional[str] = None, base_url: Optional[str] = None,
+                 workers: Optional[int] = None) -> None:
+        super().__init__(workers)
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.root = Path(root or os.getenv("LOCAL_STORAGE_DIR", os.path.join(project_dir, "local_storage")))
+        self.base_url = base_url or os.getenv("LOCAL_STORAGE_URL", self.root.resolve().as_uri())
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def put_object(self, key: str, data: bytes, content_type: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def get_object(self, key: str) -> tuple:
+        data = self._path(key).read_bytes()
+        return data, f'"{hashlib.md5(data).hexdigest()}"'
+
+    def head_etag(self, key: str) -> Optional[str]:
+        try:
+            return self.get_object(key)[1]
+        except FileNotFoundError:
+            return None
+
+    def delete_object(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def presigned_url(self, key: str, filename: str, content_type: str, expires: int) -> str:
+        return f"{self.base_url.rstrip('/')}/{key}"
+
+    def _parts_dir(self, key: str, upload_id: str) -> Path:
+        path = self._path(key)
+        return path.with_name(f"{path.name}.{upload_id}.parts")
+
+    def create_multipart(self, key: str, content_type: str) -> str:
+        upload_id = os.urandom(8).hex()
+        self._parts_dir(key, upload_id).mkdir(parents=True)
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> dict:
+        (self._parts_dir(key, upload_id) / str(number)).write_bytes(data)
+        return {"PartNumber": number}
+
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> None:
+        parts_dir = self._parts_dir(key, upload_id)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{upload_id}.tmp")
+        with open(tmp_path, "wb") as out:
+            for part in sorted(parts, key=lambda part: part["PartNumber"]):
+                with open(parts_dir / str(part["PartNumber"]), "rb") as src:
+                    shutil.copyfileobj(src, out)
+        os.replace(tmp_path, path)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    def abort_multipart(self, key: str, upload_id: str) -> None:
+        shutil.rmtree(self._parts_dir(key, upload_id), ignore_errors=True)
+
+
+def get_storage() -> Storage:
+    """Builds the backend selected by ``STORAGE_BACKEND`` (``s3`` or ``local``)."""
+    if os.getenv("STORAGE_BACKEND", "s3") == "local":
+        return LocalStorage()
+    return S3Storage()
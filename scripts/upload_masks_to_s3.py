@@ -12,6 +12,8 @@ load_dotenv()
 
 
 from app.models import PhoneBrand, PhoneModel
+from scripts.catalog import bump_catalog_version
+from scripts.render_profiles import refresh_render_profiles
 
 class MaskUploader:
 
@@ -66,12 +68,17 @@ class MaskUploader:
                 print(f"Skipping {model_name}")
         self.update_db(mask_uploaded)
     
+    def head_etag(self, key):
+        return self.s3.head_object(Bucket=os.getenv("AWS_S3_BUCKET"), Key=key).get("ETag")
+
     def update_db(self, mask_uploaded):
         with self.session() as session:
             session.execute(
                 update(PhoneModel).where(PhoneModel.id.in_(mask_uploaded)).values(mask_available = True)
             )
+            refresh_render_profiles(session, self.head_etag)
             session.commit()
+        bump_catalog_version()
 
 MaskUploader().upload_to_s3()
 
@@ -0,0 +1,283 @@
+import os
+import json
+import signal
+import asyncio
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from scripts.generation_jobs import add_event
+
+UPSCALE_STREAM = "upscale:jobs"
+UPSCALE_DEAD_LETTER_STREAM = "upscale:dead"
+UPSCALE_GROUP = "upscalers"
+JOB_TTL_SECONDS = 86400
+UPSCALE_DONE_CHANNEL_PREFIX = "upscale_done:"
+TERMINAL_STATUSES = ("done", "failed")
+UPSCALE_OPTIONS = ("upscaler", "pixels")
+
+
+def job_key(img_uuid: str) -> str:
+    return f"upscale_job:{img_uuid}"
+
+
+def done_channel(img_uuid: str) -> str:
+    return f"{UPSCALE_DONE_CHANNEL_PREFIX}{img_uuid}"
+
+
+async def enqueue_upscale_jobs(r: Redis, jobs: dict, events_key: Optional[str] = None,
+                               options: Optional[dict] = None, job_options: Optional[dict] = None) -> None:
+    """Creates the job records and publishes the jobs in one pipeline round trip.
+
+    Args:
+        r (Redis): Shared async Redis client
+        jobs (dict): Maps image uuid to the url of the image to upscale
+        events_key (Optional[str], optional): Generation job event stream to
+            report ``upscaled``/``upscale_failed`` to. Defaults to None.
+        options (Optional[dict], optional): Keyword arguments of the upscale
+            call (``upscaler``, ``pixels``), None values are left out.
+        job_options (Optional[dict], optional): Maps image uuid to options
+            of that job only, e.g. the ``pixels`` of each image.
+    """
+    def encode(values: Optional[dict]) -> dict:
+        return {key: str(value) for key, value in (values or {}).items() if value is not None}
+
+    options = encode(options)
+    job_options = job_options or {}
+    async with r.pipeline(transaction=False) as pipe:
+        for img_uuid, image_url in jobs.items():
+            fields = {"img_uuid": img_uuid, "image_url": str(image_url), **options,
+                      **encode(job_options.get(img_uuid))}
+            if events_key:
+                fields["events_key"] = events_key
+            pipe.hset(job_key(img_uuid), mapping={"status": "pending", "image_url": str(image_url), "attempts": 0})
+            pipe.expire(job_key(img_uuid), JOB_TTL_SECONDS)
+            pipe.xadd(UPSCALE_STREAM, fields,
+                      maxlen=int(os.getenv("UPSCALE_STREAM_MAXLEN", 100000)), approximate=True)
+        await pipe.execute()
+
+
+async def get_job(r: Redis, img_uuid: str) -> dict:
+    return await r.hgetall(job_key(img_uuid))
+
+
+class UpscaleNotifier:
+    """Lets requests wait for an upscale to finish instead of polling.
+
+    The worker publishes on ``upscale_done:<img_uuid>`` when a job is done or
+    dead-lettered. Each API process holds a single pattern subscription to
+    those channels and resolves the futures of the requests waiting on that
+    image, so waiting costs no Redis commands and one connection per process.
+    A missed message (e.g. while resubscribing) only means the waiter times
+    out and reads the job record.
+    """
+
+    def __init__(self, r: Redis) -> None:
+        self.r = r
+        self.waiters = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.notified = 0
+
+    async def _ensure_listening(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        async with self._lock:
+            if self._task is not None and not self._task.done():
+                return
+            pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+            await pubsub.psubscribe(f"{UPSCALE_DONE_CHANNEL_PREFIX}*")
+            self._task = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub) -> None:
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                img_uuid = message["channel"].removeprefix(UPSCALE_DONE_CHANNEL_PREFIX)
+                for future in self.waiters.pop(img_uuid, ()):
+                    if not future.done():
+                        future.set_result(json.loads(message["data"]))
+                        self.notified += 1
+        except Exception as err:
+            # The next waiter resubscribes
+            print(f"❌ Upscale notifications interrupted: {err}")
+        finally:
+            await pubsub.aclose()
+
+    async def wait(self, img_uuid: str, timeout: float) -> dict:
+        """Returns the upscale job record of an image once it is done or
+        failed, or as it stands after ``timeout`` seconds.
+
+        Args:
+            img_uuid (str): Image uuid returned by the generate endpoints
+            timeout (float): Longest wait in seconds
+
+        Returns:
+            dict: Job record, empty if the image is unknown
+        """
+        job = await get_job(self.r, img_uuid)
+        if not job or job.get("status") in TERMINAL_STATUSES or timeout <= 0:
+            return job
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(img_uuid, set()).add(future)
+        try:
+            await self._ensure_listening()
+            # Read again now that the subscription is active, in case the
+            # job finished in between
+            job = await get_job(self.r, img_uuid)
+            if job.get("status") in TERMINAL_STATUSES:
+                return job
+            try:
+                return {**job, **await asyncio.wait_for(future, timeout)}
+            except asyncio.TimeoutError:
+                return await get_job(self.r, img_uuid)
+        finally:
+            waiters = self.waiters.get(img_uuid)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self.waiters[img_uuid]
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"waiting": sum(len(waiters) for waiters in self.waiters.values()), "notified": self.notified}
+
+
+class UpscaleWorker:
+    """Consumes upscale jobs from a Redis Stream consumer group.
+
+    Runs as its own process (``python -m scripts.upscale_queue``) so upscaling
+    never competes with request handling. At most ``UPSCALE_CONCURRENCY``
+    jobs run at once; a failed job is re-published after an exponential
+    backoff and moved to the dead-letter stream after
+    ``UPSCALE_MAX_ATTEMPTS``. Messages of a crashed worker stay pending in
+    the group and are reclaimed by any worker once idle for
+    ``UPSCALE_CLAIM_IDLE_MS``.
+    """
+
+    def __init__(self, r: Redis, upscale, consumer: Optional[str] = None) -> None:
+        self.r = r
+        self.upscale = upscale
+        self.consumer = consumer or f"{os.uname().nodename}-{os.getpid()}"
+        self.concurrency = int(os.getenv("UPSCALE_CONCURRENCY", 4))
+        self.max_attempts = int(os.getenv("UPSCALE_MAX_ATTEMPTS", 3))
+        self.backoff_base = float(os.getenv("UPSCALE_BACKOFF_SECONDS", 5))
+        self.claim_idle_ms = int(os.getenv("UPSCALE_CLAIM_IDLE_MS", 10 * 60 * 1000))
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.tasks = set()
+        self.stopping = False
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.r.xgroup_create(UPSCALE_STREAM, UPSCALE_GROUP, id="0", mkstream=True)
+        except ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+
+    async def process(self, message_id: str, fields: dict) -> None:
+        img_uuid = fields["img_uuid"]
+        attempts = await self.r.hincrby(job_key(img_uuid), "attempts", 1)
+        await self.r.hset(job_key(img_uuid), "status", "processing")
+        try:
+            signed_url = await self.upscale(fields["image_url"], img_uuid,
+                                            **{key: fields[key] for key in UPSCALE_OPTIONS if key in fields})
+        except Exception as err:
+            print(f"Upscale of {img_uuid} failed (attempt {attempts}): {err}")
+            await self.retry_or_dead_letter(message_id, fields, attempts, str(err))
+            return
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.hset(job_key(img_uuid), mapping={"status": "done", "url": signed_url})
+            pipe.expire(job_key(img_uuid), JOB_TTL_SECONDS)
+            if fields.get("events_key"):
+                add_event(pipe, fields["events_key"], "upscaled", {img_uuid: signed_url})
+            pipe.publish(done_channel(img_uuid), json.dumps({"status": "done", "url": signed_url}))
+            pipe.xack(UPSCALE_STREAM, UPSCALE_GROUP, message_id)
+            await pipe.execute()
+
+    async def retry_or_dead_letter(self, message_id: str, fields: dict, attempts: int, error: str) -> None:
+        img_uuid = fields["img_uuid"]
+        if attempts >= self.max_attempts:
+            async with self.r.pipeline(transaction=True) as pipe:
+                pipe.xadd(UPSCALE_DEAD_LETTER_STREAM, {**fields, "error": error, "attempts": attempts})
+                pipe.hset(job_key(img_uuid), mapping={"status": "failed", "error": error})
+                if fields.get("events_key"):
+                    add_event(pipe, fields["events_key"], "upscale_failed", {img_uuid: error})
+                pipe.publish(done_channel(img_uuid), json.dumps({"status": "failed", "error": error}))
+                pipe.xack(UPSCALE_STREAM, UPSCALE_GROUP, message_id)
+                await pipe.execute()
+            return
+        await self.r.hset(job_key(img_uuid), "status", "pending")
+        self.slots.release()
+        try:
+            await asyncio.sleep(self.backoff_base * 2 ** (attempts - 1))
+        finally:
+            await self.slots.acquire()
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.xadd(UPSCALE_STREAM, fields)
+            pipe.xack(UPSCALE_STREAM, UPSCALE_GROUP, message_id)
+            await pipe.execute()
+
+    def _spawn(self, message_id: str, fields: dict) -> None:
+        async def run():
+            try:
+                await self.process(message_id, fields)
+            finally:
+                self.slots.release()
+        task = asyncio.create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self) -> None:
+        await self.ensure_group()
+        print(f"✅ Upscale worker {self.consumer} consuming {UPSCALE_STREAM}")
+        claim_checked_at = 0.0
+        while not self.stopping:
+            await self.slots.acquire()
+            messages = []
+            if time.monotonic() - claim_checked_at > self.claim_idle_ms / 1000 / 2:
+                _, messages, _ = await self.r.xautoclaim(UPSCALE_STREAM, UPSCALE_GROUP, self.consumer,
+                                                         min_idle_time=self.claim_idle_ms, count=1)
+                claim_checked_at = time.monotonic() if not messages else claim_checked_at
+            if not messages:
+                response = await self.r.xreadgroup(UPSCALE_GROUP, self.consumer, {UPSCALE_STREAM: ">"},
+                                                   count=1, block=5000)
+                messages = response[0][1] if response else []
+            if not messages:
+                self.slots.release()
+                continue
+            message_id, fields = messages[0]
+            if not fields:
+                # Entry trimmed from the stream while it was pending
+                await self.r.xack(UPSCALE_STREAM, UPSCALE_GROUP, message_id)
+                self.slots.release()
+                continue
+            self._spawn(message_id, fields)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def main():
+    from app.redis_client import create_redis_pool
+    from scripts.utils import Utils
+    r = Redis(connection_pool=create_redis_pool())
+    utils = Utils()
+    worker = UpscaleWorker(r, utils.upscale_image)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: setattr(worker, "stopping", True))
+    try:
+        await worker.run()
+    finally:
+        utils.close()
+        await r.aclose(close_connection_pool=True)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    asyncio.run(main())
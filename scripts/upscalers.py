@@ -0,0 +1,145 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+REAL_ESRGAN_MODEL = "nightmareai/real-esrgan:f121d640bd286e1fdc67f9799164c1d5be36ff74576ee11c803ae5b665dd46aa"
+
+
+def lanczos_upscale(img_bytes: bytes, scale: int, sharpen: float = 0.6, png_compression: int = 3) -> Optional[bytes]:
+    """Lanczos resize followed by an unsharp mask, encoded as PNG.
+
+    Args:
+        img_bytes (bytes): Encoded source image
+        scale (int): Upscale factor
+        sharpen (float, optional): Unsharp mask amount, 0 disables it. Defaults to 0.6.
+        png_compression (int, optional): zlib level of the output. Defaults to 3,
+            much faster than OpenCV's default for a few percent larger files.
+
+    Returns:
+        Optional[bytes]: PNG bytes, or None if the image could not be decoded
+    """
+    import cv2
+    import numpy as np
+    image = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    upscaled = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_LANCZOS4)
+    if sharpen:
+        blurred = cv2.GaussianBlur(upscaled, (0, 0), sigmaX=0.5 * scale)
+        upscaled = cv2.addWeighted(upscaled, 1 + sharpen, blurred, -sharpen, 0)
+    success, encoded = cv2.imencode(".png", upscaled, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+    return encoded.tobytes() if success else None
+
+
+def image_pixels(img_bytes: bytes) -> int:
+    """Pixel count of an encoded image, read from its header without
+    decoding it. 0 if the format is not recognised."""
+    from io import BytesIO
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with Image.open(BytesIO(img_bytes)) as image:
+            width, height = image.size
+    except (UnidentifiedImageError, OSError):
+        return 0
+    return width * height
+
+
+async def fetch_image(image_url: str) -> bytes:
+    """Downloads the image to upscale: a provider or presigned URL, or a
+    ``file://`` link of the local storage backend."""
+    if image_url.startswith("file://"):
+        return await asyncio.to_thread(Path(unquote(urlparse(image_url).path)).read_bytes)
+    import httpx
+    async with httpx.AsyncClient(timeout=60) as client:
+        response = await client.get(image_url)
+        response.raise_for_status()
+        return response.content
+
+
+class ReplicateUpscaler:
+    """Real-ESRGAN on Replicate. Returns the output as an async byte stream
+    for ``Storage.upload_stream``."""
+    name = "replicate"
+
+    async def upscale(self, image_url: str, scale: int):
+        import replicate
+        return await replicate.async_run(REAL_ESRGAN_MODEL,
+                                         input={"image": image_url, "scale": scale, "face_enhance": False})
+
+
+class LanczosUpscaler:
+    """Local CPU upscaler running ``lanczos_upscale`` on a process pool of
+    ``UPSCALE_LOCAL_WORKERS`` processes. Good enough for a plain 2x of the
+    smooth, already detailed FLUX outputs, at no per-call cost."""
+    name = "lanczos"
+
+    def __init__(self, workers: Optional[int] = None, sharpen: Optional[float] = None) -> None:
+        self.workers = workers or int(os.getenv("UPSCALE_LOCAL_WORKERS", os.cpu_count() or 1))
+        self.sharpen = sharpen if sharpen is not None else float(os.getenv("UPSCALE_LOCAL_SHARPEN", 0.6))
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def upscale_bytes(self, img_bytes: bytes, scale: int) -> bytes:
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, lanczos_upscale,
+                                                                  img_bytes, scale, self.sharpen)
+        if result is None:
+            raise ValueError("Could not decode the image to upscale")
+        return result
+
+    async def upscale(self, image_url: str, scale: int) -> bytes:
+        return await self.upscale_bytes(await fetch_image(image_url), scale)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+class UpscalerRouter:
+    """Picks the upscaler of a job.
+
+    A job may name a backend (``replicate``, ``lanczos``); otherwise, or with
+    ``auto``, ``UPSCALE_BACKEND`` decides. With ``UPSCALE_BACKEND=auto``
+    images whose upscaled size is at most ``UPSCALE_LOCAL_MAX_MEGAPIXELS`` are
+    upscaled locally and larger ones remotely.
+    """
+
+    def __init__(self, upscalers: list, default: Optional[str] = None,
+                 local_max_megapixels: Optional[float] = None) -> None:
+        self.upscalers = {upscaler.name: upscaler for upscaler in upscalers}
+        self.default = default or os.getenv("UPSCALE_BACKEND", "replicate")
+        self.local_max_pixels = (local_max_megapixels if local_max_megapixels is not None else
+                                 float(os.getenv("UPSCALE_LOCAL_MAX_MEGAPIXELS", 40))) * 1_000_000
+        self.selected = {name: 0 for name in self.upscalers}
+
+    def select(self, requested: Optional[str] = None, pixels: int = 0, scale: int = 2):
+        """Returns the upscaler for a job.
+
+        Args:
+            requested (Optional[str], optional): Backend asked for by the job. Defaults to None.
+            pixels (int, optional): Pixel count of the source image, 0 if unknown. Defaults to 0.
+            scale (int, optional): Upscale factor. Defaults to 2.
+        """
+        name = requested if requested in self.upscalers else self.default
+        if name not in self.upscalers:
+            local = pixels and pixels * scale * scale <= self.local_max_pixels
+            name = "lanczos" if local else "replicate"
+        self.selected[name] += 1
+        return self.upscalers[name]
+
+    def shutdown(self) -> None:
+        for upscaler in self.upscalers.values():
+            if hasattr(upscaler, "shutdown"):
+                upscaler.shutdown()
+
+    def stats(self) -> dict:
+        return {"default": self.default, "selected": self.selected}
@@ -1,56 +1,110 @@
 import asyncio
 import os
-import io
-import replicate
 import base64
-import redis
-import redis.exceptions
-import boto3
-import  numpy as np
-import cv2
-from PIL import Image
+from functools import cached_property
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+from redis.asyncio import Redis
 from datetime import datetime
-from botocore.client import Config
 from uuid import UUID, uuid4
-from passlib.context import CryptContext
-import cloudinary
-import cloudinary.uploader as cd_uploader
-from huggingface_hub import InferenceClient
-from fastapi import HTTPException, BackgroundTasks, status
-import smtplib
+from fastapi import HTTPException, status
 from email.message import EmailMessage
+from scripts.encoders import get_output_format
+from scripts.mail import MailQueue, MailTemplates
+from scripts.mask_cache import MaskCache
+from scripts.passwords import PasswordHasher
+from scripts.prompt_cache import PromptCache
+from scripts.providers import ProviderRouter, build_providers
+from scripts.rate_limit import RateLimiter
+from scripts.upscale_queue import enqueue_upscale_jobs, get_job
+from scripts.upscalers import image_pixels
+
+if TYPE_CHECKING:
+    from scripts.render_profiles import RenderProfile
+
+# cv2, numpy, boto3, replicate, cloudinary and huggingface_hub are imported on
+# first use so that workers only serving the catalog and auth endpoints never
+# pay for them. See `python -m scripts.benchmarks startup`.
+LAZY_CLIENTS = ("client", "storage", "mask_store", "mask_cache", "image_pipeline", "prompt_cache",
+                "provider_router", "upscalers")
+GENERATION_MODEL = "black-forest-labs/flux-schnell"
 
 
 class Utils:
 
     def __init__(self) -> None:
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        self.client = InferenceClient(
+        current_file = os.path.abspath(__file__)
+        self.project_dir = os.path.dirname(os.path.dirname(current_file))
+        self.rate_limiter = RateLimiter()
+        self.prompt_cache_enabled = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+    @cached_property
+    def client(self):
+        from huggingface_hub import InferenceClient
+        return InferenceClient(
             provider="together",
             api_key=os.environ["HF_TOKEN"],
         )
-        cloudinary.config(
-            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-            api_key=os.getenv("CLOUDINARY_API_KEY"),
-            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-            secure=True
-        )
-        self.s3 = boto3.client(
-            "s3",
-            region_name=os.getenv("AWS_REGION"),  
-            config=Config(signature_version="s3v4")
-        )
-        current_file = os.path.abspath(__file__)
-        self.project_dir = os.path.dirname(os.path.dirname(current_file))
-        self.max_gen_for_anon = 1
-        try:
-            self.r = redis.Redis(host=os.getenv("REDIS_SERVER", "localhost"), 
-                                 port=int(os.getenv("REDIS_PORT", 0)), 
-                                 decode_responses=True)
-            self.r.ping()
-            print("✅ Redis server is running.")
-        except redis.exceptions.ConnectionError:
-            print("❌ Redis server is NOT running.")
+
+    @cached_property
+    def passwords(self) -> PasswordHasher:
+        return PasswordHasher()
+
+    @cached_property
+    def upscalers(self):
+        from scripts.upscalers import LanczosUpscaler, ReplicateUpscaler, UpscalerRouter
+        return UpscalerRouter([ReplicateUpscaler(), LanczosUpscaler()])
+
+    @cached_property
+    def mail_templates(self) -> MailTemplates:
+        return MailTemplates(os.path.join(self.project_dir, "templates"))
+
+    @cached_property
+    def mailer(self) -> MailQueue:
+        return MailQueue()
+
+    @cached_property
+    def storage(self):
+        from scripts.storage import get_storage
+        return get_storage()
+
+    @cached_property
+    def mask_store(self):
+        from scripts.mask_store import MaskStore
+        return MaskStore()
+
+    @cached_property
+    def mask_cache(self) -> MaskCache:
+        return MaskCache(self.storage, decoder=lambda b: self.mask_store.compile(self.decode_mask(b)))
+
+    @cached_property
+    def image_pipeline(self):
+        from scripts.image_pipeline import ImagePipeline
+        return ImagePipeline(self.mask_store)
+
+    @cached_property
+    def prompt_cache(self) -> PromptCache:
+        return PromptCache(self.storage)
+
+    @cached_property
+    def provider_router(self) -> ProviderRouter:
+        return ProviderRouter(build_providers(self))
+
+    def warm_up(self) -> None:
+        """Builds every lazily created client up front, trading startup time
+        for a first generation request without import latency."""
+        for name in LAZY_CLIENTS:
+            getattr(self, name)
+
+    def close(self) -> None:
+        """Shuts down the pools of the clients that were actually created."""
+        if "image_pipeline" in self.__dict__:
+            self.image_pipeline.shutdown()
+        if "storage" in self.__dict__:
+            self.storage.shutdown()
+        if "passwords" in self.__dict__:
+            self.passwords.shutdown()
+        if "upscalers" in self.__dict__:
+            self.upscalers.shutdown()
 
     @staticmethod
     def mm_to_pixels(mm: float, dpi: int = 300) -> int:
@@ -69,56 +123,20 @@ class Utils:
         else:
             return ((pixel_value // 16) + 1) * 16
 
-    async def generate_with_hf(self, prompt: str, phone_height:float, phone_width:float):
-        """_summary_
-
-        Args:
-            prompt (str): _description_
-            phone_height (float): _description_
-            phone_width (float): _description_
-
-        Returns:
-            _type_: _description_
-        """
-        img_height = self.mm_to_pixels(float(phone_height))
-        img_width = self.mm_to_pixels(float(phone_width))
-
-        return await asyncio.to_thread(self.client.text_to_image, 
-                                    prompt=prompt, 
-                                    model="black-forest-labs/FLUX.1-schnell", 
-                                    height=img_height,
-                                    width=img_width
-                                    )
-
-
-    async def generate_with_replicate(self, prompt: str, phone_height:float, phone_width:float, num_outputs:int) -> list:
-        """_summary_
+    async def generate(self, prompt: str, profile: "RenderProfile", num_outputs: int) -> list:
+        """Generates PNGs through the provider router, which picks the fastest
+        healthy provider and hedges slow calls (see scripts/providers.py).
 
         Args:
-            prompt (str): _description_
-            phone_height (float): _description_
-            phone_width (float): _description_
-            num_outputs (int): _description_
+            prompt (str): User prompt
+            profile (RenderProfile): Precomputed render profile of the phone model
+            num_outputs (int): Number of images to generate
 
         Returns:
-            _type_: _description_
+            list: GeneratedImage objects, empty if every provider failed
         """
-        outputs = []
-        img_height = self.mm_to_pixels(float(phone_height))
-        img_width = self.mm_to_pixels(float(phone_width))
-        input = {
-            "prompt": prompt,
-            "aspect_ratio": self.closest_aspect_ratio(img_width, img_height),
-            "output_format": "png",
-            "num_outputs":num_outputs
-        }
-        try:
-            outputs =  await replicate.async_run("black-forest-labs/flux-schnell", 
-                                            input=input)
-        except Exception as err:
-            print(f"Following error occurred while generating image: {err} \n" \
-                  f"input params: {input}")
-        return outputs # type: ignore
+        return await self.provider_router.generate(prompt, profile.pixel_width, profile.pixel_height,
+                                                   profile.aspect_ratio, num_outputs)
     
 
     @staticmethod
@@ -150,104 +168,155 @@ class Utils:
 
     @staticmethod
     def upload_to_cloudinary(img_bytes):
+        import cloudinary
+        import cloudinary.uploader as cd_uploader
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+            secure=True
+        )
         upload_result = cd_uploader.upload(img_bytes)
         return upload_result.get('url', "")
 
-    def upload_to_s3(self, img_bytes, file_uuid):
-        """_summary_
+    async def upload_to_s3(self, img_bytes, file_uuid, content_type: str = "image/png"):
+        """Uploads an image without blocking the event loop and returns a
+        download link valid for a day.
 
         Args:
-            img_bytes (_type_): _description_
-            file_uuid (_type_): _description_
+            img_bytes (bytes): Encoded image bytes
+            file_uuid (str): Object key, also used as the download file name
+            content_type (str, optional): Defaults to "image/png".
 
         Returns:
-            _type_: _description_
+            str: Presigned download link
         """
-        file_uuid = str(file_uuid)
-        self.s3.upload_fileobj(
-            Fileobj=io.BytesIO(img_bytes),
-            Bucket=os.getenv("AWS_S3_BUCKET"),
-            Key=file_uuid,
-            ExtraArgs={'ContentType': 'image/png'}
-            )
-        signed_url = self.s3.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": os.getenv("AWS_S3_BUCKET"), 
-                    "ResponseContentDisposition": f"attachment; filename={file_uuid}.png",
-                    "Key": file_uuid,
-                    "ResponseContentType": "image/png"},
-            ExpiresIn=86400
-        )
-        return signed_url
+        return await self.storage.upload(str(file_uuid), img_bytes, content_type=content_type, expires=86400)
 
-    def hash_password(self, password: str):
-        return self.pwd_context.hash(password)
-    
-    def verify_pass_word(self, plain_pass: str, hashed_pass: str):
-        return self.pwd_context.verify(plain_pass, hashed_pass)
+    async def generate_cached(self, prompt: str, profile: "RenderProfile", num_outputs: int, r: Redis) -> list:
+        """Serves a generation from the prompt cache, calling the provider only
+        on a miss. Concurrent identical requests share one provider call.
+
+        Args:
+            prompt (str): User prompt
+            profile (RenderProfile): Precomputed render profile of the phone model
+            num_outputs (int): Number of images to generate
+            r (Redis): Shared async Redis client holding the cache index
+
+        Returns:
+            list: Outputs with ``url`` and ``aread``, empty if generation failed
+        """
+        if not self.prompt_cache_enabled:
+            return await self.generate(prompt, profile, num_outputs)
+        digest = PromptCache.cache_key(prompt, GENERATION_MODEL, profile.aspect_ratio, num_outputs)
+        return await self.prompt_cache.get_or_generate(r, digest, lambda: self.generate(prompt, profile, num_outputs))
+
+    async def hash_password(self, password: str) -> str:
+        return await self.passwords.hash(password)
+
+    async def verify_pass_word(self, plain_pass: str, hashed_pass: Optional[str]) -> tuple:
+        """Verifies a password off the event loop.
+
+        Args:
+            plain_pass (str): Password sent by the user
+            hashed_pass (Optional[str]): Stored hash
+
+        Returns:
+            tuple: (matches, new hash to store when the stored one is a
+                bcrypt or outdated-cost hash, else None)
+        """
+        return await self.passwords.verify_and_update(plain_pass, hashed_pass)
     
-    def validate_max_gen_anon(self, anon_id):
-        """_summary_
+    async def check_generation_quota(self, r: Redis, tier: str, identity: str) -> None:
+        """Counts a generation against the quota of ``identity`` in one Redis
+        round trip.
 
         Args:
-            anon_id (_type_): _description_
+            r (Redis): Shared async Redis client
+            tier (str): ``anon`` (anon_id cookie) or ``user`` (public_id)
+            identity (str): Cookie value or public_id
 
         Raises:
-            HTTPException: _description_
+            HTTPException: 403 for anonymous users (they are asked to log in),
+                429 for users, both with a Retry-After header
         """
-        count = int(self.r.get(anon_id)) if self.r.get(anon_id) else 0 # type: ignore
-        if count and count >= self.max_gen_for_anon: # type: ignore
-            raise  HTTPException(status_code=403, 
-                                 detail="Kindly login to generate further exiting designs!!!")
-        self.r.set(anon_id, (count + 1)) # type: ignore
-    
+        result = await self.rate_limiter.hit(r, tier, identity)
+        if result.allowed:
+            return
+        headers = {"Retry-After": str(result.retry_after)}
+        if tier == "anon":
+            raise HTTPException(status_code=403, headers=headers,
+                                detail="Kindly login to generate further exiting designs!!!")
+        raise HTTPException(status_code=429, headers=headers,
+                            detail="Generation limit reached. Kindly try again later")
+
     async def handle_generation(
-            self, prompt: str, phone_height:float, phone_width: float, model_id:UUID, brand_id:UUID, bg_tasks: BackgroundTasks
-            ) -> dict:
-        """_summary_
+            self, prompt: str, profile: "RenderProfile", r: Redis, variants: int = 1, progress: Optional[Callable[..., Awaitable]] = None,
+            upscale_events_key: Optional[str] = None, upscaler: Optional[str] = None,
+            output_format: str = "png") -> dict:
+        """Generates ``variants`` designs in one provider call and processes
+        them concurrently, so N variants cost close to the latency of one.
 
         Args:
             prompt (str): _description_
-            phone_height (float): _description_
-            phone_width (float): _description_
-            s3_path (str): _description_
-            bg_tasks (BackgroundTasks): _description_
+            profile (RenderProfile): Precomputed render profile of the phone
+                model, served by the phone catalog snapshot
+            r (Redis): Shared async Redis client, used to queue the upscale jobs
+            variants (int, optional): Number of designs to generate. Defaults to 1.
+            progress (Optional[Callable[..., Awaitable]], optional): Awaited with
+                each stage name (generating, compositing, uploaded) and its payload.
+            upscale_events_key (Optional[str], optional): Event stream the upscale
+                worker reports to once the images are upscaled.
+            upscaler (Optional[str], optional): Upscale backend asked for by
+                the request. Defaults to None (``UPSCALE_BACKEND``).
+            output_format (str, optional): Encoding of the previews, a preset
+                of scripts.encoders.OUTPUT_FORMATS. Defaults to "png".
 
         Returns:
-            dict: _description_
+            dict: Maps each image uuid to its download link
         """      
-        outputs = await self.generate_with_replicate(
-            prompt,
-            phone_height, 
-            phone_width,  
-            1
+        if progress:
+            await progress("generating")
+        outputs, mask = await asyncio.gather(
+            self.generate_cached(prompt, profile, variants, r),
+            self.get_mask(profile.model_id, profile.brand_id, profile.mask_etag)
         )
-        return_data = {}
-        for out in outputs:
+        if not outputs:
+            raise HTTPException(status_code=502, detail="Could not generate the image. Kindly try again")
+        if progress:
+            await progress("compositing")
+        mask_rgb, alpha = mask
+        content_type = get_output_format(output_format).content_type
+
+        async def process_output(out) -> tuple:
             img_bytes = await out.aread()
-            np_arr = np.frombuffer(img_bytes, np.uint8)
-            image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            mask = self.get_mask_from_s3(model_id, brand_id)
-            image = cv2.resize(image, (mask.shape[1], mask.shape[0]), interpolation=cv2.INTER_LANCZOS4)
-            mask_rgb = mask[:, :, :3]
-            alpha = mask[:, :, 3]
-            mask_rgb = mask_rgb / 255.0
-            masked_image = (image * mask_rgb).astype(np.uint8)
-            masked_image = cv2.merge([masked_image, alpha])
-            success, masked_img_bytes = cv2.imencode(".png", masked_image)
-            if not success:
+            img_uuid = str(uuid4())
+            # Providers that do not host their output (hf) need a URL the
+            # upscaler can fetch, uploaded while the image is composited
+            raw_upload = None if out.url else asyncio.create_task(self.upload_to_s3(img_bytes, f"{img_uuid}_raw"))
+            masked_img_bytes = await self.image_pipeline.render(img_bytes, profile.brand_id, profile.model_id,
+                                                                mask_rgb, alpha, output_format)
+            if not masked_img_bytes:
                 raise HTTPException(status_code=500, detail="Error while image processing. Kindly try again")
-            img_uuid = uuid4()
-            img_link = self.upload_to_s3(masked_img_bytes.tobytes(), str(img_uuid))
-            return_data[str(img_uuid)] = img_link
-            self.r.set(str(img_uuid), "pending")
-            bg_tasks.add_task(self.upscale_image, out.url, img_uuid)
+            img_link = await self.upload_to_s3(masked_img_bytes, img_uuid, content_type)
+            # The upscaler gets the provider output, not the render
+            return img_uuid, img_link, out.url or await raw_upload, image_pixels(img_bytes)
+
+        processed = await asyncio.gather(*(process_output(out) for out in outputs))
+        return_data = {img_uuid: img_link for img_uuid, img_link, _, _ in processed}
+        pending = {img_uuid: image_url for img_uuid, _, image_url, _ in processed}
+        # ``uploaded`` goes first so event stream readers know which images
+        # to wait for before any of them can be reported upscaled
+        if progress:
+            await progress("uploaded", return_data)
+        await enqueue_upscale_jobs(r, pending, events_key=upscale_events_key, options={"upscaler": upscaler},
+                                   job_options={img_uuid: {"pixels": pixels or None}
+                                                for img_uuid, _, _, pixels in processed})
 
         return return_data
         
-    @staticmethod
-    def send_email(to_email: str, subject: str, body=None, html_content=None):
-        """_summary_
+    def send_email(self, to_email: str, subject: str, body=None, html_content=None):
+        """Queues a mail for the background sender and returns immediately.
 
         Args:
             to_email (str): _description_
@@ -256,7 +325,7 @@ class Utils:
             html_content (_type_, optional): _description_. Defaults to None.
 
         Raises:
-            HTTPException: _description_
+            HTTPException: 500 without a body, 503 when the mail queue is full
         """
         msg = EmailMessage()
         msg['Subject'] = subject
@@ -270,11 +339,11 @@ class Utils:
         else:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                                 detail="Could not send mail. Body missing")
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-            smtp.starttls()
-            smtp.login(os.getenv("GMAIL_ID", ""), os.getenv('GMAIL_APP_PASS', ""))
-            smtp.send_message(msg)
+        try:
+            self.mailer.submit(msg)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Could not send mail right now. Kindly try again in a few minutes")
 
     def send_reset_mail(self, to_email: str, reset_link: str):
         """_summary_
@@ -284,48 +353,97 @@ class Utils:
             reset_link (str): _description_
         """
         subject = "Password Recovery Mail"
-        template_path = os.path.join(self.project_dir, "templates", "reset_password_mail.html")
-        with open(template_path, 'r', encoding='utf-8') as file:
-            html = file.read()
-        html_content = html.replace("{reset_link}", reset_link).replace("{year}", str(datetime.now().year))
+        html_content = self.mail_templates.render("reset_password_mail.html", reset_link=reset_link,
+                                                  year=datetime.now().year)
         self.send_email(to_email=to_email, subject=subject, html_content=html_content)
     
-    def upscale_image(self, image_url, file_uuid, scale=2):
-        """_summary_
+    async def upscale_image(self, image_url, file_uuid, scale=2, upscaler: Optional[str] = None,
+                            pixels: int = 0) -> str:
+        """Upscales a generated image and uploads the result. Run by the
+        upscale worker (scripts/upscale_queue.py), not by the web tier.
 
         Args:
             image_url (_type_): _description_
             file_uuid (_type_): _description_
             scale (int, optional): _description_. Defaults to 2.
-        """
-        input={
-            "image": image_url,
-            "scale": scale,
-            "face_enhance": False
-        }
-        output = replicate.run(
-            ref="nightmareai/real-esrgan:f121d640bd286e1fdc67f9799164c1d5be36ff74576ee11c803ae5b665dd46aa",
-            input=input
-        )
-        signed_url = self.upload_to_s3(img_bytes=output.read(), file_uuid=f"{str(file_uuid)}_upscaled") #type: ignore
-        self.r.set(str(file_uuid), signed_url, ex=86400)
-
-    def get_image_download_link(self, img_uuid: str) -> str:
-        return str(self.r.get(str(img_uuid)))
+            upscaler (Optional[str], optional): Backend asked for by the request,
+                see UpscalerRouter. Defaults to None.
+            pixels (int, optional): Pixel count of the image at ``image_url``,
+                used by ``UPSCALE_BACKEND=auto``. Defaults to 0 (unknown).
 
-    def get_mask_from_s3(self, model_id:UUID, brand_id:UUID):
-        """_summary_
+        Returns:
+            str: Download link of the upscaled image
+        """
+        backend = self.upscalers.select(upscaler, int(pixels), scale)
+        output = await backend.upscale(str(image_url), scale)
+        key = f"{str(file_uuid)}_upscaled"
+        if isinstance(output, bytes):
+            return await self.storage.upload(key, output, content_type="image/png", expires=86400)
+        # Streamed into a multipart upload part by part, the upscaled image
+        # (tens of MB) is never held in memory as a whole
+        return await self.storage.upload_stream(key, output, content_type="image/png", expires=86400)
+
+    async def get_image_download_link(self, img_uuid: str, r: Redis) -> str:
+        """Reads the upscale job record of an image.
 
         Args:
-            model_id (UUID): _description_
-            brand_id (UUID): _description_
+            img_uuid (str): Image uuid returned by the generate endpoints
+            r (Redis): Shared async Redis client
 
         Returns:
-            _type_: _description_
+            str: The download link once upscaled, "pending" while queued or
+                running, "failed" once dead-lettered, or "None" if unknown
         """
-        response = self.s3.get_object(Bucket=os.getenv("AWS_S3_BUCKET"), 
-                                 Key=f"Masks/{brand_id}/{model_id}")
-        img_bytes = response.get("Body").read()
+        job = await get_job(r, str(img_uuid))
+        status = job.get("status")
+        if status == "done":
+            return job["url"]
+        if status == "processing":
+            return "pending"
+        return str(status)
+
+    @staticmethod
+    def decode_mask(img_bytes: bytes):
+        import cv2
+        import numpy as np
         np_arr = np.frombuffer(img_bytes, np.uint8)
         img = cv2.imdecode(np_arr, cv2.IMREAD_UNCHANGED)
-        return img
\ No newline at end of file
+        img.setflags(write=False)
+        return img
+
+    async def get_mask(self, model_id:UUID, brand_id:UUID, etag: Optional[str] = None) -> tuple:
+        """Returns the compiled mask from the local memory-mapped store, falling
+        back to S3 for masks that have not been compiled on this host or were
+        compiled from another version of the mask.
+
+        Args:
+            model_id (UUID): Phone model id
+            brand_id (UUID): Brand id of the phone model
+            etag (Optional[str], optional): Mask ETag recorded in the render
+                profile; a compiled mask must match it and a cached mask with
+                this ETag needs no revalidation.
+
+        Returns:
+            tuple: (BGR channels, alpha)
+        """
+        compiled = self.mask_store.load(brand_id, model_id, etag)
+        if compiled is not None:
+            return compiled
+        cached = self.mask_cache.get_cached(brand_id, model_id, etag)
+        if cached is not None:
+            return cached
+        return await self.storage.run(self.get_mask_from_s3, model_id, brand_id)
+
+    def get_mask_from_s3(self, model_id:UUID, brand_id:UUID) -> tuple:
+        """Returns the compiled mask, served from the in-process mask cache
+        after the first request for a phone model. Blocking on a cache miss,
+        so async callers go through ``get_mask``.
+
+        Args:
+            model_id (UUID): Phone model id
+            brand_id (UUID): Brand id of the phone model
+
+        Returns:
+            tuple: (BGR channels, alpha)
+        """
+        return self.mask_cache.get(brand_id, model_id)